@@ -154,6 +154,9 @@ parser.add_option("--coverage_include", dest="coverageInclude", default=None, ty
 # Some useful constants to be used throughout everything
 BASE58CHARS  = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
 BASE16CHARS  = '0123456789abcdefABCDEF'
+# For "is every char of the string one of these" tests:  set(s) <= charSet
+BASE58CHARSET = frozenset(BASE58CHARS)
+BASE16CHARSET = frozenset(BASE16CHARS)
 LITTLEENDIAN  = '<'
 BIGENDIAN     = '>'
 NETWORKENDIAN = '!'
@@ -1804,10 +1807,9 @@ def isLikelyDataType(theStr, dtype=None):
    why it's called "likely" datatype...
    """
    ret = None
-   hexCount = sum([1 if c in BASE16CHARS else 0 for c in theStr])
-   b58Count = sum([1 if c in BASE58CHARS else 0 for c in theStr])
-   canBeHex = hexCount==len(theStr)
-   canBeB58 = b58Count==len(theStr)
+   strChars = set(theStr)
+   canBeHex = strChars <= BASE16CHARSET
+   canBeB58 = strChars <= BASE58CHARSET
    if canBeHex:
       ret = DATATYPE.Hex
    elif canBeB58 and not canBeHex:
@@ -1885,12 +1887,14 @@ def RightNowStr(fmt=DEFAULT_DATE_FORMAT):
 # use hash256 and hash160 which use the first three to create the ONLY hash
 # operations we ever do in the bitcoin network
 # UPDATE:  mini-private-key format requires vanilla sha256...
+# The named constructors skip the digest lookup by name that hashlib.new()
+# does on every call, which is about half the cost of hashing a short string
 def sha1(bits):
-   return hashlib.new('sha1', bits).digest()
+   return hashlib.sha1(bits).digest()
 def sha256(bits):
-   return hashlib.new('sha256', bits).digest()
+   return hashlib.sha256(bits).digest()
 def sha512(bits):
-   return hashlib.new('sha512', bits).digest()
+   return hashlib.sha512(bits).digest()
 def ripemd160(bits):
    # It turns out that not all python has ripemd160...?
    #return hashlib.new('ripemd160', bits).digest()
@@ -1903,13 +1907,17 @@ def hash160(s):
    return Cpp.BtcUtils().getHash160_SWIG(s)
 
 
+# Byte-wise XOR with the HMAC pad bytes, as str.translate() tables
+HMAC_OPAD_TABLE = ''.join([chr(0x5c ^ i) for i in range(256)])
+HMAC_IPAD_TABLE = ''.join([chr(0x36 ^ i) for i in range(256)])
+
 def HMAC(key, msg, hashfunc=sha512, hashsz=None):
    """ This is intended to be simple, not fast.  For speed, use HDWalletCrypto() """
    hashsz = len(hashfunc('')) if hashsz==None else hashsz
    key = (hashfunc(key) if len(key)>hashsz else key)
    key = key.ljust(hashsz, '\x00')
-   okey = ''.join([chr(ord('\x5c')^ord(c)) for c in key])
-   ikey = ''.join([chr(ord('\x36')^ord(c)) for c in key])
+   okey = key.translate(HMAC_OPAD_TABLE)
+   ikey = key.translate(HMAC_IPAD_TABLE)
    return hashfunc( okey + hashfunc(ikey + msg) )
 
 HMAC256 = lambda key,msg: HMAC(key, msg, sha256, 32)
@@ -2106,6 +2114,29 @@ def binary_to_base58(binstr):
    return '1'*padding + b58
 
 
+################################################################################
+def walletID_to_base58(binstr):
+   """
+   Same output as binary_to_base58, specialized for the 6-byte wallet unique
+   IDs.  Six bytes fit in a native int, so there is no per-byte bignum
+   accumulation and the divmod loop runs on small ints.
+   """
+   if len(binstr) != 6:
+      return binary_to_base58(binstr)
+
+   hi,lo = unpack('>HI', binstr)
+   n = (hi << 32) | lo
+
+   b58 = []
+   while n > 0:
+      n, r = divmod(n, 58)
+      b58.append(BASE58CHARS[r])
+   b58.reverse()
+
+   padding = 6 - len(binstr.lstrip('\x00'))
+   return '1'*padding + ''.join(b58)
+
+
 ################################################################################
 def base58_to_binary(addr):
    """
@@ -2199,7 +2230,7 @@ def addrStr_is_p2sh(b58Str):
    if len(b58Str)==0:
       return False
 
-   if sum([(0 if c in BASE58CHARS else 1) for c in b58Str]) > 0:
+   if not set(b58Str) <= BASE58CHARSET:
       return False
 
    binStr = base58_to_binary(b58Str)
@@ -2867,13 +2898,9 @@ def decodeMiniPrivateKey(keyStr):
 
 ################################################################################
 def parsePrivateKeyData(theStr):
-      hexChars = '01234567890abcdef'
-      b58Chars = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
-
-      hexCount = sum([1 if c in hexChars else 0 for c in theStr.lower()])
-      b58Count = sum([1 if c in b58Chars else 0 for c in theStr])
-      canBeHex = hexCount==len(theStr)
-      canBeB58 = b58Count==len(theStr)
+      strChars = set(theStr)
+      canBeHex = strChars <= BASE16CHARSET
+      canBeB58 = strChars <= BASE58CHARSET
 
       binEntry = ''
       keyType = ''
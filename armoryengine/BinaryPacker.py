@@ -30,10 +30,13 @@ class BinaryPacker(object):
       >> result = bp.getBinaryString()
    """
    def __init__(self):
+      # Whole pieces are appended and joined once at the end, the running
+      # size saves walking the list every time getSize() is called
       self.binaryConcat = []
+      self.size = 0
 
    def getSize(self):
-      return sum([len(a) for a in self.binaryConcat])
+      return self.size
 
    def getBinaryString(self):
       return ''.join(self.binaryConcat)
@@ -51,36 +54,38 @@ class BinaryPacker(object):
       """
       E = endianness
       if   varType == UINT8:
-         self.binaryConcat += int_to_binary(theData, 1, endianness)
+         piece = int_to_binary(theData, 1, endianness)
       elif varType == UINT16:
-         self.binaryConcat += int_to_binary(theData, 2, endianness)
+         piece = int_to_binary(theData, 2, endianness)
       elif varType == UINT32:
-         self.binaryConcat += int_to_binary(theData, 4, endianness)
+         piece = int_to_binary(theData, 4, endianness)
       elif varType == UINT64:
-         self.binaryConcat += int_to_binary(theData, 8, endianness)
+         piece = int_to_binary(theData, 8, endianness)
       elif varType == INT8:
-         self.binaryConcat += pack(E+'b', theData)
+         piece = pack(E+'b', theData)
       elif varType == INT16:
-         self.binaryConcat += pack(E+'h', theData)
+         piece = pack(E+'h', theData)
       elif varType == INT32:
-         self.binaryConcat += pack(E+'i', theData)
+         piece = pack(E+'i', theData)
       elif varType == INT64:
-         self.binaryConcat += pack(E+'q', theData)
+         piece = pack(E+'q', theData)
       elif varType == VAR_INT:
-         self.binaryConcat += packVarInt(theData)[0]
+         piece = packVarInt(theData)[0]
       elif varType == VAR_STR:
-         self.binaryConcat += packVarInt(len(theData))[0]
-         self.binaryConcat += theData
+         piece = packVarInt(len(theData))[0] + theData
       elif varType == FLOAT:
-         self.binaryConcat += pack(E+'f', theData)
+         piece = pack(E+'f', theData)
       elif varType == BINARY_CHUNK:
          if width==None:
-            self.binaryConcat += theData
+            piece = theData
          else:
             if len(theData)>width:
                raise PackerError, 'Too much data to fit into fixed width field'
-            self.binaryConcat += theData.ljust(width, '\x00')
+            piece = theData.ljust(width, '\x00')
       else:
          raise PackerError, "Var type not recognized!  VarType="+str(varType)
 
+      self.binaryConcat.append(piece)
+      self.size += len(piece)
+
 
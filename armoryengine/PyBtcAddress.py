@@ -517,6 +517,36 @@ class PyBtcAddress(object):
             # without checking for empty public key. 
             return SecureBinaryData(0)
 
+   #############################################################################
+   def safeExtendPublicKeyChain(self, pubKey, chn, count):
+      # Same paranoia as safeExtendPublicKey, but each run derives all count
+      # keys in a single C++ call instead of one call per chain step
+      newPubs1 = CryptoECDSA().ComputeChainedPublicKeys(pubKey, chn, count)
+      newPubs2 = CryptoECDSA().ComputeChainedPublicKeys(pubKey, chn, count)
+
+      if len(newPubs1)!=count or len(newPubs2)!=count or \
+         not all([p1==p2 for p1,p2 in zip(newPubs1, newPubs2)]):
+         LOGCRIT('Chaining failed!  Computed key chains are different!')
+         LOGCRIT('Falling back to extending one key at a time')
+         newPubs = []
+         prevPub = pubKey
+         for i in range(count):
+            prevPub = self.safeExtendPublicKey(prevPub, chn)
+            newPubs.append(prevPub)
+         return newPubs
+
+      newPubs = []
+      prevPub = pubKey
+      with open(MULT_LOG_FILE,'a') as f:
+         for newPub in newPubs1:
+            logMult = CryptoECDSA().ComputeChainMultiplier(prevPub, chn)
+            f.write('PubChain (pkh, mult): %s,%s\n' % \
+               (binary_to_hex(prevPub.getHash160()), binary_to_hex(logMult)))
+            newPub = SecureBinaryData(newPub)
+            newPubs.append(newPub)
+            prevPub = newPub
+      return newPubs
+
    #############################################################################
    def lock(self, secureKdfOutput=None, generateIVIfNecessary=False):
       # We don't want to destroy the private key if it's not supposed to be
@@ -562,6 +592,44 @@ class PyBtcAddress(object):
       return self.binInitVect16 if newIV else SecureBinaryData()
 
 
+   #############################################################################
+   def ensureEncryptedCopy(self, secureKdfOutput, generateIVIfNecessary=False):
+      """
+      Make sure the encrypted private key is filled in, without locking the
+      address.  This leaves the address in the same state as lock() followed
+      by unlock(), but skips the decryption and the pub/priv key match check
+      that the unlock() would do on a key we just had in plaintext anyway.
+      """
+      newIV = False
+      if not self.useEncryption or not self.binPrivKey32_Plain.getSize()==32:
+         # Not supposed to be encrypted, or no plaintext key to encrypt
+         return SecureBinaryData()
+
+      if self.binPrivKey32_Encr.getSize()==32 and not self.keyChanged:
+         # Already have the encrypted priv key
+         return SecureBinaryData()
+
+      if secureKdfOutput==None:
+         raise WalletLockError, 'No encryption key provided to encrypt priv key'
+
+      if self.binInitVect16.getSize() < 16:
+         if not generateIVIfNecessary:
+            raise KeyDataError, 'No Initialization Vector available'
+         else:
+            self.binInitVect16 = SecureBinaryData().GenerateRandom(16)
+            newIV = True
+
+      self.binPrivKey32_Encr = CryptoAES().EncryptCFB( \
+                                       self.binPrivKey32_Plain, \
+                                       SecureBinaryData(secureKdfOutput), \
+                                       self.binInitVect16)
+      self.isLocked = False
+      self.keyChanged = False
+
+      # In case we changed the IV, we should let the caller know this
+      return self.binInitVect16 if newIV else SecureBinaryData()
+
+
    #############################################################################
    def unlock(self, secureKdfOutput, skipCheck=False):
       """
@@ -601,9 +669,10 @@ class PyBtcAddress(object):
          self.createPrivKeyNextUnlock_IVandKey   = []
          self.createPrivKeyNextUnlock_ChainDepth = 0
 
-         # Lock/Unlock to make sure encrypted private key is filled
-         self.lock(secureKdfOutput,generateIVIfNecessary=True)
-         self.unlock(secureKdfOutput)
+         # Make sure encrypted private key is filled.  A key we just chained
+         # always gets checked against the stored public key below
+         self.ensureEncryptedCopy(secureKdfOutput, generateIVIfNecessary=True)
+         skipCheck = False
 
       else:
 
@@ -670,10 +739,14 @@ class PyBtcAddress(object):
       else:
          # Re-encrypt with new key (using same IV)
          self.useEncryption = True
-         self.lock(secureNewKey)  # do this to make sure privKey_Encr filled
          if wasLocked:
+            self.lock(secureNewKey)  # do this to make sure privKey_Encr filled
             self.isLocked = True
+         elif self.binPrivKey32_Plain.getSize()==32:
+            # Still have the plaintext key, no need to decrypt and re-check it
+            self.ensureEncryptedCopy(secureNewKey)
          else:
+            self.lock(secureNewKey)
             self.unlock(secureNewKey)
             self.isLocked = False
 
@@ -868,6 +941,36 @@ class PyBtcAddress(object):
                newAddr.createPrivKeyNextUnlock_ChainDepth  = 1
          return newAddr
 
+   #############################################################################
+   @TimeThisFunction
+   def extendPublicAddressChain(self, count):
+      """
+      Compute the next count addresses of a chain that has no private key
+      data (i.e. watching-only), in one batch.  The result is identical to
+      calling extendAddressChain() count times, each time on the previous
+      result, but the EC math for the whole run happens in C++.
+      """
+      if not self.chaincode.getSize() == 32:
+         raise KeyDataError, 'No chaincode has been defined to extend chain'
+      if self.hasPrivKey():
+         raise KeyDataError, 'Use extendAddressChain for private key chains'
+      if not self.hasPubKey():
+         raise KeyDataError, 'No public key available to extend chain'
+
+      newAddrList = []
+      newPubs = self.safeExtendPublicKeyChain( \
+                                    self.binPublicKey65, self.chaincode, count)
+      for i,newPub in enumerate(newPubs):
+         newAddr = PyBtcAddress()
+         newAddr.binPublicKey65 = newPub
+         newAddr.addrStr20 = newPub.getHash160()
+         newAddr.useEncryption = self.useEncryption
+         newAddr.isInitialized = True
+         newAddr.chaincode  = self.chaincode
+         newAddr.chainIndex = self.chainIndex+1+i
+         newAddrList.append(newAddr)
+      return newAddrList
+
 
    def serialize(self):
       """
@@ -918,13 +1021,10 @@ class PyBtcAddress(object):
          serializeWithEncryption = False
 
       # Before starting, let's construct the flags for this address
-      nFlagBytes = 8
-      flags = [False]*nFlagBytes*8
-      flags[0] = self.hasPrivKey()
-      flags[1] = self.hasPubKey()
-      flags[2] = serializeWithEncryption
-      flags[3] = self.createPrivKeyNextUnlock
-      flags = ''.join([('1' if f else '0') for f in flags])
+      flags = int(bool(self.hasPrivKey()))                   | \
+              int(bool(self.hasPubKey()))              << 1  | \
+              int(bool(serializeWithEncryption))       << 2  | \
+              int(bool(self.createPrivKeyNextUnlock))  << 3
 
       def raw(a):
          if isinstance(a, str):
@@ -948,7 +1048,7 @@ class PyBtcAddress(object):
       binOut.put(BINARY_CHUNK,   self.addrStr20,                    width=20)
       binOut.put(BINARY_CHUNK,   chk(self.addrStr20),               width= 4)
       binOut.put(UINT32,         getVersionInt(PYBTCWALLET_VERSION))
-      binOut.put(UINT64,         bitset_to_int(flags))
+      binOut.put(UINT64,         flags)
 
       # Write out address-chaining parameters (for deterministic wallets)
       binOut.put(BINARY_CHUNK,   raw(self.chaincode),               width=32)
@@ -1021,13 +1121,12 @@ class PyBtcAddress(object):
       addrVerInt     = serializedData.get(UINT32)
       flags          = serializedData.get(UINT64)
       self.addrStr20 = verifyChecksum(self.addrStr20, chkAddr20)
-      flags = int_to_bitset(flags, widthBytes=8)
 
       # Interpret the flags
-      containsPrivKey              = (flags[0]=='1')
-      containsPubKey               = (flags[1]=='1')
-      self.useEncryption           = (flags[2]=='1')
-      self.createPrivKeyNextUnlock = (flags[3]=='1')
+      containsPrivKey              = bool(flags & 1)
+      containsPubKey               = bool(flags & 2)
+      self.useEncryption           = bool(flags & 4)
+      self.createPrivKeyNextUnlock = bool(flags & 8)
 
       addrChkError = False
       if len(self.addrStr20)==0:
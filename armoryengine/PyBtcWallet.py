@@ -11,6 +11,14 @@
 ##############################################################################
 import os.path
 import shutil
+import struct
+from multiprocessing.pool import ThreadPool
+
+try:
+   import fcntl
+except ImportError:
+   # Windows
+   fcntl = None
 
 from CppBlockUtils import SecureBinaryData, KdfRomix, CryptoAES, CryptoECDSA
 import CppBlockUtils as Cpp
@@ -43,6 +51,61 @@ WLT_DATATYPE_DELETED     = 4
 DEFAULT_COMPUTE_TIME_TARGET = 0.25
 DEFAULT_MAXMEM_LIMIT        = 32*1024*1024
 
+# balType strings accepted by getBalance/getAddrBalance.  getBalance maps to
+# the cached wallet balance attributes, getAddrBalance to the index in the
+# [full, spendable, unconfirmed] lists of addrBalanceDict
+WLT_BALANCE_ATTRS = { 'spendable':   'balance_spendable',
+                      'spend':       'balance_spendable',
+                      'unconfirmed': 'balance_unconfirmed',
+                      'unconf':      'balance_unconfirmed',
+                      'total':       'balance_full',
+                      'ultimate':    'balance_full',
+                      'unspent':     'balance_full',
+                      'full':        'balance_full' }
+
+ADDR_BALANCE_INDEX = { 'spendable':   1,
+                       'spend':       1,
+                       'unconfirmed': 2,
+                       'unconf':      2,
+                       'ultimate':    0,
+                       'unspent':     0,
+                       'full':        0 }
+
+# Fixed-size front of the wallet header, packed in one go by packHeader:
+# fileID, version, magic, flags, uniqueID, createDate, short label, long
+# label, highest used index, KDF params, crypto params
+WLT_HEADER_STRUCT = struct.Struct('<8sI4sQ6sQ32s256sq256s256s')
+
+WLT_OFFSET_FLAGS       = struct.calcsize('<8sI4s')
+WLT_OFFSET_LABEL_NAME  = struct.calcsize('<8sI4sQ6sQ')
+WLT_OFFSET_LABEL_DESCR = struct.calcsize('<8sI4sQ6sQ32s')
+WLT_OFFSET_TOP_USED    = struct.calcsize('<8sI4sQ6sQ32s256s')
+WLT_OFFSET_KDF_PARAMS  = struct.calcsize('<8sI4sQ6sQ32s256sq')
+WLT_OFFSET_CRYPTO      = struct.calcsize('<8sI4sQ6sQ32s256sq256s')
+WLT_OFFSET_ROOT_ADDR   = WLT_HEADER_STRUCT.size
+
+# KDF params field: memory reqt, iterations, salt (then checksum and padding)
+WLT_KDF_STRUCT = struct.Struct('<QI32s')
+
+# Headers of the variable-length wallet entries: dtype, [hashVal,] length
+WLT_ADDRCOMMENT_HDR_STRUCT = struct.Struct('<B20sH')
+WLT_TXCOMMENT_HDR_STRUCT   = struct.Struct('<B32sH')
+WLT_DELETED_HDR_STRUCT     = struct.Struct('<BH')
+
+# hasAddr sees Base58 strings for every wallet's addresses, not just its own,
+# so its decode cache is dropped and started over once it gets this big
+WLT_B58_CACHE_MAX_ENTRIES = 4096
+
+# Wallets with fewer addresses than this are unlocked on the calling thread,
+# bigger ones with a pool of WLT_UNLOCK_THREADS (1 means never use a pool)
+WLT_UNLOCK_POOL_MIN_ADDRS = 64
+WLT_UNLOCK_MAX_THREADS    = 8
+WLT_UNLOCK_THREADS = min(multiprocessing.cpu_count(), WLT_UNLOCK_MAX_THREADS)
+
+# Imported keys aren't on the chain; they all get this placeholder chaincode.
+# It's never modified, and PyBtcAddress.copy() shares it by reference anyway
+IMPORTED_ADDR_CHAINCODE = SecureBinaryData('\xff'*32)
+
 PYROOTPKCCVER = 1 # Current version of root pub key/chain code backup format
 PYROOTPKCCVERMASK = 0x7F
 PYROOTPKCCSIGNMASK = 0x80
@@ -184,6 +247,10 @@ class PyBtcWallet(object):
    wallet locking.
    """
 
+   # Size of a serialized PyBtcAddress, filled in by the first __init__ call
+   # (PyBtcAddress is only imported at the end of this module)
+   PYBTCADDR_SIZE = None
+
    #############################################################################
    def __init__(self):
       self.fileTypeStr    = '\xbaWALLET\x00'
@@ -205,6 +272,9 @@ class PyBtcWallet(object):
       self.linearAddr160List = []
       self.chainIndexMap = {}
       self.txAddrMap = {}    # cache for getting tx-labels based on addr search
+      self.b58Hash160Cache = {}  # Base58 addr strings already decoded by hasAddr
+      self.chainOrderCache = []  # addrMap keys by chainIndex, see unlock
+      self.linearOrderCache = [] # linearAddr160List by chainIndex, see getAddrListSortedByChainIndex
       if USE_TESTNET or USE_REGTEST:
          self.addrPoolSize = 10  # this makes debugging so much easier!
       else:
@@ -214,12 +284,15 @@ class PyBtcWallet(object):
 
       # For file sync features
       self.walletPath = ''
+      self.walletPathCache = {}  # (walletPath, suffix) -> path, see getWalletPath
+      self.cloneBackupOk = WLT_REFLINK_BACKUP  # False if reflink cloning fails
       self.doBlockchainSync = BLOCKCHAIN_READONLY
       self.lastSyncBlockNum = 0
 
       # Private key encryption details
       self.useEncryption  = False
       self.kdf            = None
+      self.kdfParamsCache = None  # (kdfObj, binWidth, serialized params)
       self.crypto         = None
       self.kdfKey         = None
       self.defaultKeyLifetime = 10    # seconds after unlock, that key is discarded
@@ -236,8 +309,10 @@ class PyBtcWallet(object):
       self.lastComputedChainIndex = 0
       self.highestUsedChainIndex  = 0 
 
-      # All PyBtcAddress serializations are exact same size, figure it out now
-      self.pybtcaddrSize = len(PyBtcAddress().serialize())
+      # All PyBtcAddress serializations are exact same size, figure it out once
+      if PyBtcWallet.PYBTCADDR_SIZE is None:
+         PyBtcWallet.PYBTCADDR_SIZE = len(PyBtcAddress().serialize())
+      self.pybtcaddrSize = PyBtcWallet.PYBTCADDR_SIZE
 
 
       # Finally, a bunch of offsets that tell us where data is stored in the
@@ -297,7 +372,7 @@ class PyBtcWallet(object):
    def isWltSigningAnyLockbox(self, lockboxList):
       for lockbox in lockboxList:
          for addr160 in lockbox.a160List:
-            if self.addrMap.has_key(addr160):
+            if addr160 in self.addrMap:
                return True
       return False
 
@@ -307,17 +382,19 @@ class PyBtcWallet(object):
 
    #############################################################################
    def getTimeRangeForAddress(self, addr160):
-      if not self.addrMap.has_key(addr160):
+      addr = self.addrMap.get(addr160)
+      if addr is None:
          return None
       else:
-         return self.addrMap[addr160].getTimeRange()
+         return addr.getTimeRange()
 
    #############################################################################
    def getBlockRangeForAddress(self, addr160):
-      if not self.addrMap.has_key(addr160):
+      addr = self.addrMap.get(addr160)
+      if addr is None:
          return None
       else:
-         return self.addrMap[addr160].getBlockRange()
+         return addr.getBlockRange()
 
    #############################################################################
    def setBlockchainSyncFlag(self, syncYes=True):
@@ -334,22 +411,33 @@ class PyBtcWallet(object):
       # Apparently, using the -threads option when compiling the swig module
       # causes the "for i in vector<...>:" mechanic to sometimes throw seg faults!
       # For this reason, this method was replaced with the one below:
+      if not self.commentsMap:
+         return ''
+
+      getComment = self.commentsMap.get
       for regTx in abe.getTxList():
-         comment = self.getComment(regTx.getTxHash())
-         if len(comment)>0:
+         comment = getComment(regTx.getTxHash())
+         if comment:
             return comment
 
       return ''
       
    #############################################################################
    def getCommentForTxList(self, a160, txhashList):
-      comment = self.getComment(a160)
-      if len(comment)>0:
+      # Most wallets have few comments and addresses can have thousands of
+      # txs: skip the scan entirely when there is nothing to find, and use
+      # the dict directly instead of a getComment call per hash
+      if not self.commentsMap:
+         return ''
+
+      getComment = self.commentsMap.get
+      comment = getComment(a160)
+      if comment:
          return comment
 
       for txHash in txhashList:
-         comment = self.getComment(txHash)
-         if len(comment)>0:
+         comment = getComment(txHash)
+         if comment:
             return comment
 
       return ''
@@ -367,10 +455,12 @@ class PyBtcWallet(object):
          
    #############################################################################
    def hasAnyImported(self):
-      for a160,addr in self.addrMap.iteritems():
-         if addr.chainIndex == -2:
-            return True
-      return False
+      # importList is kept in sync by readWalletFile and the import methods,
+      # only wallets assembled by hand in memory (forkOnlineWallet) need the
+      # full scan
+      if len(self.importList) > 0:
+         return True
+      return any(addr.chainIndex == -2 for addr in self.addrMap.itervalues())
    
    def isRegistered(self):
       return not self.cppWallet == None 
@@ -382,17 +472,10 @@ class PyBtcWallet(object):
    # change was always deprioritized, but using --nospendzeroconfchange makes
    # it totally unspendable
    def getBalance(self, balType="Spendable"):
-      if balType.lower() in ('spendable','spend'):
-         return self.balance_spendable
-         #return self.cppWallet.getSpendableBalance(topBlockHeight, IGNOREZC)
-      elif balType.lower() in ('unconfirmed','unconf'):
-         #return self.cppWallet.getUnconfirmedBalance(topBlockHeight, IGNOREZC)
-         return self.balance_unconfirmed
-      elif balType.lower() in ('total','ultimate','unspent','full'):
-         #return self.cppWallet.getFullBalance()
-         return self.balance_full
-      else:
+      attr = WLT_BALANCE_ATTRS.get(balType.lower())
+      if attr is None:
          raise TypeError('Unknown balance type! "' + balType + '"')
+      return getattr(self, attr)
       
    #############################################################################
    def getTxnCount(self):
@@ -415,20 +498,19 @@ class PyBtcWallet(object):
       if not self.hasAddr(addr160):
          return -1
       else:
-         try:
-            scraddr = Hash160ToScrAddr(addr160)
-            addrBalances = self.addrBalanceDict[scraddr]
-         except:
+         # hasAddr also takes address objects, the key needs their hash160.
+         # Past that, skip Hash160ToScrAddr's length check (a Base58 string
+         # simply misses below) and build the scrAddr key directly
+         if isinstance(addr160, PyBtcAddress):
+            addr160 = addr160.getAddr160()
+         addrBalances = self.addrBalanceDict.get(HASH160PREFIX + addr160)
+         if addrBalances is None:
             return 0
          
-         if balType.lower() in ('spendable','spend'):
-            return addrBalances[1]
-         elif balType.lower() in ('unconfirmed','unconf'):
-            return addrBalances[2]
-         elif balType.lower() in ('ultimate','unspent','full'):
-            return addrBalances[0]
-         else:
+         idx = ADDR_BALANCE_INDEX.get(balType.lower())
+         if idx is None:
             raise TypeError('Unknown balance type!')
+         return addrBalances[idx]
 
 
 
@@ -438,10 +520,7 @@ class PyBtcWallet(object):
       """ 
       Gets the ledger entries for the entire wallet, from C++/SWIG data structs
       """
-      ledgBlkChain = self.getHistoryPage(0)
-      ledg = []
-      ledg.extend(ledgBlkChain)
-      return ledg
+      return list(self.getHistoryPage(0))
 
    #############################################################################
    @CheckWalletRegistration
@@ -580,13 +659,21 @@ class PyBtcWallet(object):
    def hasAddr(self, addrData):
       if isinstance(addrData, str):
          if len(addrData) == 20:
-            return self.addrMap.has_key(addrData)
-         elif isLikelyDataType(addrData)==DATATYPE.Base58:
-            return self.addrMap.has_key(addrStr_to_hash160(addrData)[1])
-         else:
-            return False
+            return addrData in self.addrMap
+
+         # Decoding Base58 is slow and the result never changes, so only do
+         # it the first time we see a given address string
+         a160 = self.b58Hash160Cache.get(addrData)
+         if a160 is None:
+            if not isLikelyDataType(addrData)==DATATYPE.Base58:
+               return False
+            a160 = addrStr_to_hash160(addrData)[1]
+            if len(self.b58Hash160Cache) >= WLT_B58_CACHE_MAX_ENTRIES:
+               self.b58Hash160Cache.clear()
+            self.b58Hash160Cache[addrData] = a160
+         return a160 in self.addrMap
       elif isinstance(addrData, PyBtcAddress):
-         return self.addrMap.has_key(addrData.getAddr160())
+         return addrData.getAddr160() in self.addrMap
       else:
          return False
 
@@ -653,7 +740,7 @@ class PyBtcWallet(object):
       walletFileBackup = self.getWalletPath('backup') if backupPath == None \
                                                                else backupPath
       try:
-         shutil.copy(self.walletPath, walletFileBackup)
+         copyWalletFile(self.walletPath, walletFileBackup)
       except IOError, errReason:
          LOGERROR('Unable to copy file %s' % backupPath)
          LOGERROR('Reason for copy failure: %s' % errReason)
@@ -671,9 +758,10 @@ class PyBtcWallet(object):
       # This function eats hex inputs. (Not sure why I chose to do that.)
       # B/c we have a known starting pt. for keys, use that instead of trying to
       # index off a chaincode value, as the value could be in the key.
-      p0 = masterHex.index('4104') + 1
+      keyStart = masterHex.index('4104')
+      p0 = keyStart + 1
       pubkey = SecureBinaryData(hex_to_binary(masterHex[p0:p0+130]))
-      c0 = masterHex.index('4104') + 66
+      c0 = keyStart + 66
       chain = SecureBinaryData(hex_to_binary(masterHex[c0:c0+64]))
 
       # Create the root address object
@@ -693,8 +781,8 @@ class PyBtcWallet(object):
       # is based not only on the private key, BUT ALSO THE CHAIN CODE
       self.useEncryption = False
       self.addrMap[firstAddr.getAddr160()] = firstAddr
-      self.uniqueIDBin = (ADDRBYTE + firstAddr.getAddr160()[:5])[::-1]
-      self.uniqueIDB58 = binary_to_base58(self.uniqueIDBin)
+      self.uniqueIDBin = firstAddr.getAddr160()[4::-1] + ADDRBYTE
+      self.uniqueIDB58 = walletID_to_base58(self.uniqueIDBin)
       self.labelName  = 'BitSafe Demo Wallet'
       self.labelDescr = 'We\'ll be lucky if this works!'
       self.lastComputedChainAddr160 = first160
@@ -736,13 +824,19 @@ class PyBtcWallet(object):
       time0,blk0 = getCurrTimeAndBlock() if isActuallyNew else (0,0)
 
       # Don't forget to sync the C++ wallet object
-      newfile.write(fileData.getBinaryString())
+      walletData = fileData.getBinaryString()
+      newfile.write(walletData)
       newfile.flush()
       os.fsync(newfile.fileno())
       newfile.close()
 
+      # The backup is identical to what we just wrote, write it from memory
+      # instead of reading the new file back in with shutil.copy
       walletFileBackup = self.getWalletPath('backup')
-      shutil.copy(self.walletPath, walletFileBackup)
+      with open(walletFileBackup, 'wb') as backupfile:
+         backupfile.write(walletData)
+         backupfile.flush()
+         os.fsync(backupfile.fileno())
 
 
       # Let's fill the address pool while we are unlocked
@@ -782,8 +876,8 @@ class PyBtcWallet(object):
 
       self.addrMap['ROOT'] = rootAddr
       self.addrMap[firstAddr.getAddr160()] = firstAddr
-      self.uniqueIDBin = (ADDRBYTE + firstAddr.getAddr160()[:5])[::-1]
-      self.uniqueIDB58 = binary_to_base58(self.uniqueIDBin)
+      self.uniqueIDBin = firstAddr.getAddr160()[4::-1] + ADDRBYTE
+      self.uniqueIDB58 = walletID_to_base58(self.uniqueIDBin)
       self.labelName  = (self.uniqueIDB58 + ' (Watch)')[:32]
       self.labelDescr  = (self.uniqueIDB58 + ' (Watching-only copy)')[:256]
       self.lastComputedChainAddr160 = first160
@@ -822,12 +916,14 @@ class PyBtcWallet(object):
       time0,blk0 = getCurrTimeAndBlock() if isActuallyNew else (0,0)
 
       # Write the actual wallet file and close it. Create a backup if necessary.
-      newfile.write(fileData.getBinaryString())
+      walletData = fileData.getBinaryString()
+      newfile.write(walletData)
       newfile.close()
 
       if not skipBackupFile:
          walletFileBackup = self.getWalletPath('backup')
-         shutil.copy(self.walletPath, walletFileBackup)
+         with open(walletFileBackup, 'wb') as backupfile:
+            backupfile.write(walletData)
 
       # Let's fill the address pool while we are unlocked. It will get a lot
       # more expensive if we do it on the next unlock.
@@ -894,6 +990,7 @@ class PyBtcWallet(object):
          (mem,niter,salt) = self.computeSystemSpecificKdfParams( \
                                                 kdfTargSec, kdfMaxMem)
          self.kdf.usePrecomputedKdfParams(mem, niter, salt)
+         self.kdfParamsCache = None
          self.kdfKey = self.kdf.DeriveKey(securePassphrase)
 
       if not plainRootKey:
@@ -921,9 +1018,9 @@ class PyBtcWallet(object):
                                              generateIVIfNecessary=True)
       rootAddr.markAsRootAddr(chaincode)
 
-      # This does nothing if no encryption
-      rootAddr.lock(self.kdfKey)
-      rootAddr.unlock(self.kdfKey)
+      # Fill in the encrypted root key, nothing to do if no encryption
+      if withEncrypt:
+         rootAddr.ensureEncryptedCopy(self.kdfKey)
 
       firstAddr = rootAddr.extendAddressChain(self.kdfKey)
       first160  = firstAddr.getAddr160()
@@ -935,8 +1032,8 @@ class PyBtcWallet(object):
       self.useEncryption = withEncrypt
       self.addrMap['ROOT'] = rootAddr
       self.addrMap[firstAddr.getAddr160()] = firstAddr
-      self.uniqueIDBin = (ADDRBYTE + firstAddr.getAddr160()[:5])[::-1]
-      self.uniqueIDB58 = binary_to_base58(self.uniqueIDBin)
+      self.uniqueIDBin = firstAddr.getAddr160()[4::-1] + ADDRBYTE
+      self.uniqueIDB58 = walletID_to_base58(self.uniqueIDBin)
       self.labelName  = shortLabel[:32]   # aka "Wallet Name"
       self.labelDescr  = longLabel[:256]  # aka "Description"
       self.lastComputedChainAddr160 = first160
@@ -975,12 +1072,14 @@ class PyBtcWallet(object):
       # basing anything on time, please assume that it is up to one day off!
       time0,blk0 = getCurrTimeAndBlock() if isActuallyNew else (0,0)
 
-      newfile.write(fileData.getBinaryString())
+      walletData = fileData.getBinaryString()
+      newfile.write(walletData)
       newfile.close()
 
       if not skipBackupFile:
          walletFileBackup = self.getWalletPath('backup')
-         shutil.copy(self.walletPath, walletFileBackup)
+         with open(walletFileBackup, 'wb') as backupfile:
+            backupfile.write(walletData)
 
       # Lock/unlock to make sure encrypted keys are computed and written to file
       if self.useEncryption:
@@ -1004,7 +1103,7 @@ class PyBtcWallet(object):
 
       self.highestUsedChainIndex = topIndex
       self.walletFileSafeUpdate( [[WLT_UPDATE_MODIFY, self.offsetTopUsed, \
-                    int_to_binary(self.highestUsedChainIndex, widthBytes=8)]])
+                    struct.pack('<q', self.highestUsedChainIndex)]])
       self.fillAddressPool(isActuallyNew=isNew)
       
    #############################################################################
@@ -1049,37 +1148,75 @@ class PyBtcWallet(object):
          addr160 = self.lastComputedChainAddr160
 
       newAddr = self.addrMap[addr160].extendAddressChain(self.kdfKey)
-      new160 = newAddr.getAddr160()
-      newDataLoc = self.walletFileSafeUpdate( \
-         [[WLT_UPDATE_ADD, WLT_DATATYPE_KEYDATA, new160, newAddr]])
-      self.addrMap[new160] = newAddr
-      self.addrMap[new160].walletByteLoc = newDataLoc[0] + 21
-
-      if newAddr.chainIndex > self.lastComputedChainIndex:
-         self.lastComputedChainAddr160 = new160
-         self.lastComputedChainIndex = newAddr.chainIndex
-
-      self.linearAddr160List.append(new160)
-      self.chainIndexMap[newAddr.chainIndex] = new160
+      new160 = self.addChainedAddresses([newAddr])[0]
          
       if self.cppWallet != None:      
-         needsRegistered = \
-            self.cppWallet.extendAddressChainTo(self.lastComputedChainIndex)  
-         
-         #grab cpp addr as default addr type
-         addrType = armoryengine.ArmoryUtils.DEFAULT_ADDR_TYPE
-         
-         if addrType == 'P2PKH':
-            self.getP2PKHAddrForIndex(newAddr.chainIndex)
-         elif addrType == 'P2SH-P2WPKH':
-            self.getNestedSWAddrForIndex(newAddr.chainIndex)
-         elif addrType == 'P2SH-P2PK':
-            self.getNestedP2PKAddrForIndex(newAddr.chainIndex)
+         needsRegistered = self.syncCppAddressChain([newAddr.chainIndex])
          
          if doRegister and self.isRegistered() and needsRegistered:
                self.cppWallet.registerWithBDV(isActuallyNew)
 
       return new160
+
+   #############################################################################
+   def addChainedAddresses(self, newAddrList):
+      """
+      Write a list of freshly chained addresses to the wallet file with a
+      single walletFileSafeUpdate, then add them to the in-memory maps.  One
+      safe-update is a full append/fsync cycle on both the wallet and its
+      backup, so batches should go through here in one call.
+
+      Returns the list of new addr160 values, in the same order.
+      """
+      updateList = []
+      for newAddr in newAddrList:
+         updateList.append( \
+            [WLT_UPDATE_ADD, WLT_DATATYPE_KEYDATA, newAddr.getAddr160(), newAddr])
+      newDataLoc = self.walletFileSafeUpdate(updateList)
+
+      new160List = [entry[2] for entry in updateList]
+      for i,newAddr in enumerate(newAddrList):
+         newAddr.walletByteLoc = newDataLoc[i] + 21
+
+      # Merge the batch into the maps in bulk rather than key by key
+      self.addrMap.update(zip(new160List, newAddrList))
+      self.chainIndexMap.update( \
+         zip([a.chainIndex for a in newAddrList], new160List))
+      self.linearAddr160List.extend(new160List)
+
+      for newAddr in newAddrList:
+         if newAddr.chainIndex > self.lastComputedChainIndex:
+            self.lastComputedChainAddr160 = newAddr.getAddr160()
+            self.lastComputedChainIndex = newAddr.chainIndex
+
+      return new160List
+
+   #############################################################################
+   def syncCppAddressChain(self, chainIndexList):
+      """
+      Extend the C++ wallet chain up to lastComputedChainIndex in one go and
+      instantiate the default address type for the given (new) chain indices.
+      Returns whether the C++ wallet grew, i.e. needs to be registered again.
+      """
+      needsRegistered = \
+         self.cppWallet.extendAddressChainTo(self.lastComputedChainIndex)  
+      
+      #grab cpp addr as default addr type
+      addrType = armoryengine.ArmoryUtils.DEFAULT_ADDR_TYPE
+      
+      if addrType == 'P2PKH':
+         getAddrForIndex = self.getP2PKHAddrForIndex
+      elif addrType == 'P2SH-P2WPKH':
+         getAddrForIndex = self.getNestedSWAddrForIndex
+      elif addrType == 'P2SH-P2PK':
+         getAddrForIndex = self.getNestedP2PKAddrForIndex
+      else:
+         return needsRegistered
+
+      for chainIndex in chainIndexList:
+         getAddrForIndex(chainIndex)
+
+      return needsRegistered
       
    #############################################################################
    def fillAddressPool(self, numPool=None, isActuallyNew=True, 
@@ -1098,13 +1235,33 @@ class PyBtcWallet(object):
       gap = self.lastComputedChainIndex - self.highestUsedChainIndex
       numToCreate = max(numPool - gap, 0)
       
-      newAddrList = []
-      
-      for i in range(numToCreate):
-         Progress(i+1, numToCreate)
-         newAddrList.append(Hash160ToScrAddr(self.computeNextAddress(\
-                                 isActuallyNew=isActuallyNew, \
-                                 doRegister=False))) 
+      # Chain the whole batch in memory first, then write it to the wallet
+      # file in one safe-update instead of one fsync'd update per address.
+      # Without private keys the chain is pure public key math, so derive
+      # the whole batch in one C++ call rather than one call per address
+      chainedAddrs = []
+      if numToCreate > 0:
+         prevAddr = self.addrMap[self.lastComputedChainAddr160]
+         if numToCreate > 1 and not prevAddr.hasPrivKey():
+            chainedAddrs = prevAddr.extendPublicAddressChain(numToCreate)
+            Progress(numToCreate, numToCreate)
+         else:
+            # Draw the IVs for the whole batch at once: every GenerateRandom
+            # call seeds a fresh AutoSeededX917RNG from the OS
+            ivBatch = SecureBinaryData().GenerateRandom(16*numToCreate)
+            ivBatch = ivBatch.toBinStr()
+            for i in range(numToCreate):
+               Progress(i+1, numToCreate)
+               newIV = SecureBinaryData(ivBatch[16*i:16*(i+1)])
+               prevAddr = prevAddr.extendAddressChain(self.kdfKey, newIV)
+               chainedAddrs.append(prevAddr)
+
+      new160List = self.addChainedAddresses(chainedAddrs)
+      newIndexList = [self.addrMap[a160].chainIndex for a160 in new160List]
+
+      # Extend the C++ wallet for the whole batch at once
+      if self.cppWallet != None and numToCreate > 0:
+         self.syncCppAddressChain(newIndexList)
                   
       #add addresses in bulk once they are all computed   
       if doRegister and self.isRegistered() and numToCreate > 0:
@@ -1170,7 +1327,7 @@ class PyBtcWallet(object):
       if highestIndex > self.highestUsedChainIndex:
          self.highestUsedChainIndex = highestIndex
          self.walletFileSafeUpdate( [[WLT_UPDATE_MODIFY, self.offsetTopUsed, \
-                                      int_to_binary(highestIndex, widthBytes=8)]])
+                                      struct.pack('<q', highestIndex)]])
 
 
       return highestIndex
@@ -1203,11 +1360,17 @@ class PyBtcWallet(object):
       self.addrPoolSize = stepSize
       # When we hit the highest address, the topCompute value will extend
       # out [stepsize] addresses beyond topUsed, and the topUsed will not
-      # change, thus escaping the while loop
+      # change, thus escaping the while loop.
+      # Every pass that still finds used addresses near the top doubles the
+      # lookahead of the next one (up to 16 steps), so a heavily used wallet
+      # needs a logarithmic rather than linear number of fill+scan passes.
+      # The exit condition is the same [stepsize] gap as before.
       nWhile = 0
+      lookAhead = stepSize
       while topCompute - topUsed < 0.9*stepSize:
-         topCompute = self.fillAddressPool(stepSize, isActuallyNew=False)
+         topCompute = self.fillAddressPool(lookAhead, isActuallyNew=False)
          topUsed = self.detectHighestUsedIndex()
+         lookAhead = min(2*lookAhead, 16*stepSize)
          nWhile += 1
          if nWhile>10000:
             raise WalletAddressError('Escaping inf loop in freshImport...')
@@ -1219,32 +1382,50 @@ class PyBtcWallet(object):
 
    #############################################################################
    def writeFreshWalletFile(self, path, newName='', newDescr=''):
-      newFile = open(path, 'wb')
       bp = BinaryPacker()
       self.packHeader(bp)
-      newFile.write(bp.getBinaryString())
 
-      for addr160,addrObj in self.addrMap.iteritems():
-         if not addr160=='ROOT':
-            newFile.write('\x00' + addr160 + addrObj.serialize())
+      # Serialize everything into one list and write it out in one go.  The
+      # root address is part of the header, the rest is written in the same
+      # order it was read (or created) in.  addrMap is what holds the keys,
+      # so anything linearAddr160List missed is still written, after it,
+      # and nothing is written twice
+      walletChunks = [bp.getBinaryString()]
+      written160 = set(['ROOT'])
+      for addr160 in self.linearAddr160List:
+         if addr160 in written160 or addr160 not in self.addrMap:
+            continue
+         written160.add(addr160)
+         addrObj = self.addrMap[addr160]
+         walletChunks.append('\x00' + addr160 + addrObj.serialize())
+
+      missed160 = [a160 for a160 in self.addrMap if a160 not in written160]
+      if len(missed160) > 0:
+         LOGWARN('%d address entries not in linearAddr160List, appending',
+                                                               len(missed160))
+         missed160.sort(key=lambda a160: self.addrMap[a160].chainIndex)
+         for addr160 in missed160:
+            addrObj = self.addrMap[addr160]
+            walletChunks.append('\x00' + addr160 + addrObj.serialize())
 
       for hashVal,comment in self.commentsMap.iteritems():
-         twoByteLength = int_to_binary(len(comment), widthBytes=2)
+         twoByteLength = struct.pack('<H', len(comment))
          if len(hashVal)==20:
-            typestr = int_to_binary(WLT_DATATYPE_ADDRCOMMENT)
-            newFile.write(typestr + hashVal + twoByteLength + comment)
+            typestr = chr(WLT_DATATYPE_ADDRCOMMENT)
+            walletChunks.append(typestr + hashVal + twoByteLength + comment)
          elif len(hashVal)==32:
-            typestr = int_to_binary(WLT_DATATYPE_TXCOMMENT)
-            newFile.write(typestr + hashVal + twoByteLength + comment)
+            typestr = chr(WLT_DATATYPE_TXCOMMENT)
+            walletChunks.append(typestr + hashVal + twoByteLength + comment)
 
-      newFile.close()
+      with open(path, 'wb') as newFile:
+         newFile.write(''.join(walletChunks))
 
    
    #############################################################################
    def makeUnencryptedWalletCopy(self, newPath, securePassphrase=None):
 
-      self.writeFreshWalletFile(newPath)
       if not self.useEncryption:
+         self.writeFreshWalletFile(newPath)
          return True
 
       if self.isLocked:
@@ -1254,15 +1435,32 @@ class PyBtcWallet(object):
          else:
             self.unlock(securePassphrase=SecureBinaryData(securePassphrase))
 
-      newWlt = PyBtcWallet().readWalletFile(newPath)
-      newWlt.unlock(self.kdfKey)
-      newWlt.changeWalletEncryption(None)
+      # Decrypt copies of the keys in memory and write those out directly,
+      # rather than writing the encrypted wallet, reading it back in and
+      # removing the encryption from the file
+      plainWallet = PyBtcWallet()
+      plainWallet.fileTypeStr = self.fileTypeStr
+      plainWallet.version = self.version
+      plainWallet.magicBytes = self.magicBytes
+      plainWallet.wltCreateDate = self.wltCreateDate
+      plainWallet.labelName = self.labelName
+      plainWallet.labelDescr = self.labelDescr
+      plainWallet.uniqueIDBin = self.uniqueIDBin
+      plainWallet.useEncryption = False
+      plainWallet.watchingOnly = self.watchingOnly
+      plainWallet.kdf = self.kdf
 
-      
-      walletFileBackup = newWlt.getWalletPath('backup')
-      if os.path.exists(walletFileBackup):
-         LOGINFO('New wallet created, deleting backup file')
-         os.remove(walletFileBackup)
+      for addr160,addrObj in self.addrMap.iteritems():
+         plainAddr = addrObj.copy()
+         plainAddr.changeEncryptionKey(self.kdfKey, None)
+         plainWallet.addrMap[addr160] = plainAddr
+
+      plainWallet.linearAddr160List = list(self.linearAddr160List)
+      plainWallet.commentsMap = self.commentsMap
+      plainWallet.opevalMap = self.opevalMap
+      plainWallet.highestUsedChainIndex = self.highestUsedChainIndex
+
+      plainWallet.writeFreshWalletFile(newPath)
       return True
       
       
@@ -1284,9 +1482,12 @@ class PyBtcWallet(object):
          LOGERROR("Tried to make encrypted copy, but no passphrase supplied")
          return False
 
-      # If we're starting unencrypted...encrypt it in place
-      (mem,nIter,salt) = self.computeSystemSpecificKdfParams(0.25)
-      self.changeKdfParams(mem, nIter, salt)
+      # If we're starting unencrypted...encrypt it in place.  A wallet that
+      # has been encrypted before (or copied this way before) still has its
+      # KDF params, no need to run the KDF calibration again
+      if not self.kdf or self.kdf.getNumIterations() == 0:
+         (mem,nIter,salt) = self.computeSystemSpecificKdfParams(0.25)
+         self.changeKdfParams(mem, nIter, salt)
       self.changeWalletEncryption(securePassphrase=securePassphrase)
    
       # Write the encrypted wallet to the target directory
@@ -1433,6 +1634,10 @@ class PyBtcWallet(object):
          onlineWallet.addrMap[addr160].useEncryption = False
          onlineWallet.addrMap[addr160].createPrivKeyNextUnlock = False
 
+      onlineWallet.linearAddr160List = list(self.linearAddr160List)
+      onlineWallet.chainIndexMap = self.chainIndexMap.copy()
+      onlineWallet.importList = list(self.importList)
+
       onlineWallet.commentsMap = self.commentsMap
       onlineWallet.opevalMap = self.opevalMap
 
@@ -1503,17 +1708,22 @@ class PyBtcWallet(object):
       if not kdfObj:
          return '\x00'*binWidth
 
-      binPacker = BinaryPacker()
-      binPacker.put(UINT64, kdfObj.getMemoryReqtBytes())
-      binPacker.put(UINT32, kdfObj.getNumIterations())
-      binPacker.put(BINARY_CHUNK, kdfObj.getSalt().toBinStr(), width=32)
+      # KdfRomix params don't change after setup, the header gets repacked
+      # on every update though
+      cache = self.kdfParamsCache
+      if cache and cache[0] is kdfObj and cache[1]==binWidth:
+         return cache[2]
 
-      kdfStr = binPacker.getBinaryString()
-      binPacker.put(BINARY_CHUNK, computeChecksum(kdfStr,4), width=4)
-      padSize = binWidth - binPacker.getSize()
-      binPacker.put(BINARY_CHUNK, '\x00'*padSize)
+      salt = kdfObj.getSalt().toBinStr()
+      if len(salt) > 32:
+         raise PackerError('Too much data to fit into fixed width field')
 
-      return binPacker.getBinaryString()
+      kdfStr = WLT_KDF_STRUCT.pack(kdfObj.getMemoryReqtBytes(), \
+                                   kdfObj.getNumIterations(), salt)
+      kdfStr += computeChecksum(kdfStr,4)
+      kdfStr += '\x00'*(binWidth - len(kdfStr))
+      self.kdfParamsCache = (kdfObj, binWidth, kdfStr)
+      return kdfStr
 
 
 
@@ -1527,12 +1737,12 @@ class PyBtcWallet(object):
 
 
 
-      allKdfData = binUnpacker.get(BINARY_CHUNK, 44)
+      allKdfData = binUnpacker.get(BINARY_CHUNK, WLT_KDF_STRUCT.size)
       kdfChksum  = binUnpacker.get(BINARY_CHUNK,  4)
       kdfBytes   = len(allKdfData) + len(kdfChksum)
       padding    = binUnpacker.get(BINARY_CHUNK, binWidth-kdfBytes)
 
-      if allKdfData=='\x00'*44:
+      if allKdfData=='\x00'*WLT_KDF_STRUCT.size:
          return None
 
       fixedKdfData = verifyChecksum(allKdfData, kdfChksum)
@@ -1544,10 +1754,7 @@ class PyBtcWallet(object):
          allKdfData = fixedKdfData
          LOGWARN('KDF params in wallet were corrupted, but fixed')
 
-      kdfUnpacker = BinaryUnpacker(allKdfData)
-      mem   = kdfUnpacker.get(UINT64)
-      nIter = kdfUnpacker.get(UINT32)
-      salt  = kdfUnpacker.get(BINARY_CHUNK, 32)
+      mem,nIter,salt = WLT_KDF_STRUCT.unpack(allKdfData)
 
       kdf = KdfRomix(mem, nIter, SecureBinaryData(salt))
       return kdf
@@ -1595,6 +1802,26 @@ class PyBtcWallet(object):
          kdfOutput.destroy()
 
 
+   #############################################################################
+   def verifyPassphraseList(self, securePassphraseList):
+      """
+      Same as verifyPassphrase, for a list of candidate passphrases (such as
+      a passphrase and its likely typos).  The KDF is run on all of them in
+      a single DeriveKeys call, which only sets up the lookup table once.
+
+      Returns the index of the first valid passphrase, or -1 if none is.
+      """
+      kdfOutputs = self.kdf.DeriveKeys(list(securePassphraseList))
+      try:
+         for i,kdfOutput in enumerate(kdfOutputs):
+            if self.addrMap['ROOT'].verifyEncryptionKey(kdfOutput):
+               return i
+         return -1
+      finally:
+         for kdfOutput in kdfOutputs:
+            kdfOutput.destroy()
+
+
    #############################################################################
    def verifyEncryptionKey(self, secureKdfOutput):
       """
@@ -1668,9 +1895,9 @@ class PyBtcWallet(object):
 
       secureSalt = SecureBinaryData(salt)
       newkdf = KdfRomix(mem, numIter, secureSalt)
-      bp = BinaryPacker()
-      bp.put(BINARY_CHUNK, self.serializeKdfParams(newkdf), width=256)
-      updList = [[WLT_UPDATE_MODIFY, self.offsetKdfParams, bp.getBinaryString()]]
+      # serializeKdfParams already pads out to the 256-byte field width
+      kdfParams = self.serializeKdfParams(newkdf)
+      updList = [[WLT_UPDATE_MODIFY, self.offsetKdfParams, kdfParams]]
 
       if not self.useEncryption:
          # We may be setting the kdf params before enabling encryption
@@ -1753,25 +1980,29 @@ class PyBtcWallet(object):
             # If there was an encryption change, we must change the flags
             # in the wallet file in the same atomic operation as changing
             # the stored keys.  We can't let them get out of sync.
-            self.useEncryption = newUsesEncryption
-            walletUpdateInfo.append(self.createChangeFlagsEntry())
-            self.useEncryption = oldUsedEncryption
-            # Restore the old flag just in case the file write fails
+            walletUpdateInfo.append( \
+               self.createChangeFlagsEntry(useEncryption=newUsesEncryption))
 
          newAddrMap  = {}
          i=1
          nAddr = len(self.addrMap)
+         # Redrawing the progress bar per address can cost more than the
+         # re-encryption itself on big wallets, so report ~200 times at most
+         prgStep = max(1, nAddr // 200)
          
+         appendUpdate = walletUpdateInfo.append
          for addr160,addr in self.addrMap.iteritems():
-            Progress(i, nAddr)
+            if i % prgStep == 0 or i == nAddr:
+               Progress(i, nAddr)
             i = i +1
             
-            newAddrMap[addr160] = addr.copy()
-            newAddrMap[addr160].enableKeyEncryption(generateIVIfNecessary=True)
-            newAddrMap[addr160].changeEncryptionKey(oldKdfKey, newKdfKey)
-            newAddrMap[addr160].walletByteLoc = addr.walletByteLoc
-            walletUpdateInfo.append( \
-               [WLT_UPDATE_MODIFY, addr.walletByteLoc, newAddrMap[addr160].serialize()])
+            newAddr = addr.copy()
+            newAddr.enableKeyEncryption(generateIVIfNecessary=True)
+            newAddr.changeEncryptionKey(oldKdfKey, newKdfKey)
+            newAddr.walletByteLoc = addr.walletByteLoc
+            newAddrMap[addr160] = newAddr
+            appendUpdate( \
+               [WLT_UPDATE_MODIFY, addr.walletByteLoc, newAddr.serialize()])
 
 
          # Try to update the wallet file with the new encrypted key data
@@ -1779,8 +2010,8 @@ class PyBtcWallet(object):
 
          if updateSuccess:
             # Finally give the new data to the user
-            for addr160,addr in newAddrMap.iteritems():
-               self.addrMap[addr160] = addr.copy()
+            # The new map already holds private copies, no need to copy again
+            self.addrMap.update(newAddrMap)
          
          self.useEncryption = newUsesEncryption
          if newKdfKey:
@@ -1794,6 +2025,11 @@ class PyBtcWallet(object):
 
    #############################################################################
    def getWalletPath(self, nameSuffix=None):
+      # Keyed on walletPath too, so reassigning it never returns stale paths
+      cacheKey = (self.walletPath, nameSuffix)
+      if self.walletPath and cacheKey in self.walletPathCache:
+         return self.walletPathCache[cacheKey]
+
       fpath = self.walletPath
 
       if self.walletPath=='':
@@ -1805,6 +2041,9 @@ class PyBtcWallet(object):
             fpath = pieces[0] + '_' + nameSuffix + pieces[1]
          else:
             fpath = pieces[0] + nameSuffix + pieces[1]
+
+      if self.walletPath:
+         self.walletPathCache[cacheKey] = fpath
       return fpath
 
 
@@ -1821,8 +2060,9 @@ class PyBtcWallet(object):
          return ''
 
       for _hash in hashList:
-         if self.commentsMap.has_key(_hash):
-            return self.commentsMap[_hash]
+         comment = self.commentsMap.get(_hash)
+         if comment is not None:
+            return comment
       
       return ''
 
@@ -1833,10 +2073,7 @@ class PyBtcWallet(object):
       In the first case, use the 20-byte binary pubkeyhash.  Use 32-byte tx
       hash for the tx-comment case.
       """
-      if self.commentsMap.has_key(hashVal):
-         return self.commentsMap[hashVal]
-      else:
-         return ''
+      return self.commentsMap.get(hashVal, '')
 
    #############################################################################
    def setComment(self, hashVal, newComment):
@@ -1847,9 +2084,34 @@ class PyBtcWallet(object):
       """
       updEntry = []
       isNewComment = False
-      if self.commentsMap.has_key(hashVal):
+      oldComment = self.commentsMap.get(hashVal)
+
+      # If the new comment fits in the old entry, rewrite that entry in place
+      # rather than blanking it and appending a new one.  The length field
+      # has to shrink with the comment, so any leftover bytes are turned into
+      # a deleted entry, which needs at least the 3 bytes of its own header.
+      if oldComment is not None and isinstance(newComment, str):
+         spareBytes = len(oldComment) - len(newComment)
+         if spareBytes==0 or spareBytes >= WLT_DELETED_HDR_STRUCT.size:
+            # Overwrite from the 2-byte comment size, after dtype and hashVal
+            replStr = struct.pack('<H', len(newComment)) + newComment
+            if spareBytes > 0:
+               deletedLen = spareBytes - WLT_DELETED_HDR_STRUCT.size
+               replStr += WLT_DELETED_HDR_STRUCT.pack(WLT_DATATYPE_DELETED, \
+                                                      deletedLen)
+               replStr += '\x00'*deletedLen
+            sizeLoc = self.commentLocs[hashVal] + 1 + len(hashVal)
+            # Only take the new comment once it is on disk
+            if len(self.walletFileSafeUpdate( \
+                           [[WLT_UPDATE_MODIFY, sizeLoc, replStr]])) == 0:
+               LOGERROR('Failed to rewrite comment in wallet file')
+               return
+            self.commentsMap[hashVal] = newComment
+            return
+
+      if oldComment is not None:
          # If there is already a comment for this address, overwrite it
-         oldCommentLen = len(self.commentsMap[hashVal])
+         oldCommentLen = len(oldComment)
          oldCommentLoc = self.commentLocs[hashVal]
          # The first 23 bytes are the datatype, hashVal, and 2-byte comment size
          offset = 1 + len(hashVal) + 2
@@ -1874,13 +2136,16 @@ class PyBtcWallet(object):
    #############################################################################
    def getAddrCommentIfAvail(self, txHash):
       # If we haven't extracted relevant addresses for this tx, yet -- do it
-      if not self.txAddrMap.has_key(txHash):
-         self.txAddrMap[txHash] = []
+      # Like getAddrCommentFromLe, txAddrMap holds 21-byte scrAddrs
+      txScrAddrs = self.txAddrMap.get(txHash)
+      if txScrAddrs is None:
+         txScrAddrs = self.txAddrMap[txHash] = []
          try:
             tx = TheBDM.bdv().getTxByHash(txHash)
          except:
             return ''
          if tx.isInitialized():
+            addrMap = self.addrMap
             for i in range(tx.getNumTxOut()):
                txout = tx.getTxOutCopy(i)
                stype = getTxOutScriptType(txout.getScript())
@@ -1889,17 +2154,18 @@ class PyBtcWallet(object):
                if stype in CPP_TXOUT_HAS_ADDRSTR:
                   addrStr = scrAddr_to_addrStr(scrAddr)
                   addr160 = addrStr_to_hash160(addrStr)[1]
-                  if self.hasAddr(addr160):
-                     self.txAddrMap[txHash].append(addr160)
+                  if addr160 in addrMap:
+                     txScrAddrs.append(scrAddr)
                else: 
                   pass
                   #LOGERROR("Unrecognized scraddr: " + binary_to_hex(scrAddr))
                
+      getComment = self.commentsMap.get
       addrComments = []
-      for a160 in self.txAddrMap[txHash]:
-         h160 = a160[1:]
-         if self.commentsMap.has_key(h160) and '[[' not in self.commentsMap[h160]:
-            addrComments.append(self.commentsMap[h160])
+      for scrAddr in txScrAddrs:
+         comment = getComment(scrAddr[1:])
+         if comment is not None and '[[' not in comment:
+            addrComments.append(comment)
 
       return '; '.join(addrComments)
 
@@ -1912,9 +2178,9 @@ class PyBtcWallet(object):
                       
       addrComments = []
       for a160 in self.txAddrMap[txHash]:
-         hash160 = a160[1:]
-         if self.commentsMap.has_key(hash160) and '[[' not in self.commentsMap[hash160]:
-            addrComments.append(self.commentsMap[hash160])
+         comment = self.commentsMap.get(a160[1:])
+         if comment is not None and '[[' not in comment:
+            addrComments.append(comment)
 
       return '; '.join(addrComments)
                      
@@ -1923,9 +2189,8 @@ class PyBtcWallet(object):
       # Smart comments for LedgerEntry objects:  get any direct comments ... 
       # if none, then grab the one for any associated addresses.
       txHash = le.getTxHash()
-      if self.commentsMap.has_key(txHash):
-         comment = self.commentsMap[txHash]
-      else:
+      comment = self.commentsMap.get(txHash)
+      if comment is None:
          # [[ COMMENTS ]] are not meant to be displayed on main ledger
          comment = self.getAddrCommentFromLe(le)
          if comment.startswith('[[') and comment.endswith(']]'):
@@ -1939,34 +2204,43 @@ class PyBtcWallet(object):
    
    #############################################################################
    def setWalletLabels(self, lshort, llong=''):
+      # Only touch the file for the labels that actually changed
+      updList = []
+      if not lshort==self.labelName:
+         toWriteS = lshort.ljust( 32, '\x00')
+         updList.append([WLT_UPDATE_MODIFY, self.offsetLabelName,  toWriteS])
+      if not llong==self.labelDescr:
+         toWriteL =  llong.ljust(256, '\x00')
+         updList.append([WLT_UPDATE_MODIFY, self.offsetLabelDescr, toWriteL])
+
       self.labelName = lshort
       self.labelDescr = llong
-      toWriteS = lshort.ljust( 32, '\x00')
-      toWriteL =  llong.ljust(256, '\x00')
-
-      updList = []
-      updList.append([WLT_UPDATE_MODIFY, self.offsetLabelName,  toWriteS])
-      updList.append([WLT_UPDATE_MODIFY, self.offsetLabelDescr, toWriteL])
       self.walletFileSafeUpdate(updList)
 
 
+   #############################################################################
+   def getWalletFlags(self, useEncryption=None, watchingOnly=None):
+      # Bit 0 is encryption, bit 1 is watching-only, the rest are unused.
+      # Either flag can be overridden to pack a state the wallet isn't in yet
+      if useEncryption is None:
+         useEncryption = self.useEncryption
+      if watchingOnly is None:
+         watchingOnly = self.watchingOnly
+      return int(bool(useEncryption)) | (int(bool(watchingOnly)) << 1)
+
    #############################################################################
    def packWalletFlags(self, binPacker):
-      nFlagBytes = 8
-      flags = [False]*nFlagBytes*8
-      flags[0] = self.useEncryption
-      flags[1] = self.watchingOnly
-      flagsBitset = ''.join([('1' if f else '0') for f in flags])
-      binPacker.put(UINT64, bitset_to_int(flagsBitset))
+      binPacker.put(UINT64, self.getWalletFlags())
 
    #############################################################################
-   def createChangeFlagsEntry(self):
+   def createChangeFlagsEntry(self, useEncryption=None, watchingOnly=None):
       """
       Packs up the wallet flags and returns a update-entry that can be included
-      in a walletFileSafeUpdate call.
+      in a walletFileSafeUpdate call.  Flags passed in replace the current
+      ones, so the entry can be built before the wallet state is changed.
       """
       bp = BinaryPacker()
-      self.packWalletFlags(bp)
+      bp.put(UINT64, self.getWalletFlags(useEncryption, watchingOnly))
       toWrite = bp.getBinaryString()
       return [WLT_UPDATE_MODIFY, self.offsetWltFlags, toWrite]
 
@@ -1978,10 +2252,9 @@ class PyBtcWallet(object):
          flagData = BinaryUnpacker( toUnpack )
 
       wltflags = flagData.get(UINT64, 8)
-      wltflags = int_to_bitset(wltflags, widthBytes=8)
-      self.useEncryption = (wltflags[0]=='1')
-      self.watchingOnly  = (wltflags[1]=='1')
-      if wltflags[2]=='1':
+      self.useEncryption = bool(wltflags & 1)
+      self.watchingOnly  = bool(wltflags & 2)
+      if wltflags & 4:
          raise isMSWallet('Cannot Open MS Wallets')
 
    #############################################################################
@@ -1991,42 +2264,40 @@ class PyBtcWallet(object):
 
       startByte = binPacker.getSize()
 
-      binPacker.put(BINARY_CHUNK, self.fileTypeStr, width=8)
-      binPacker.put(UINT32, getVersionInt(self.version))
-      binPacker.put(BINARY_CHUNK, self.magicBytes,  width=4)
-
-      # Wallet info flags
-      self.offsetWltFlags = binPacker.getSize() - startByte
-      self.packWalletFlags(binPacker)
-
-      # Binary Unique ID (firstAddr25bytes[:5][::-1])
-      binPacker.put(BINARY_CHUNK, self.uniqueIDBin, width=6)
-
-      # Unix time of wallet creations
-      binPacker.put(UINT64, self.wltCreateDate)
-
-      # User-supplied wallet label (short)
-      self.offsetLabelName = binPacker.getSize() - startByte
-      binPacker.put(BINARY_CHUNK, self.labelName , width=32)
-
-      # User-supplied wallet label (long)
-      self.offsetLabelDescr = binPacker.getSize() - startByte
-      binPacker.put(BINARY_CHUNK, self.labelDescr,  width=256)
-
-      # Highest used address: 
-      self.offsetTopUsed = binPacker.getSize() - startByte
-      binPacker.put(INT64, self.highestUsedChainIndex)
-
-      # Key-derivation function parameters
-      self.offsetKdfParams = binPacker.getSize() - startByte
-      binPacker.put(BINARY_CHUNK, self.serializeKdfParams(), width=256)
-
-      # Wallet encryption parameters (currently nothing to put here)
-      self.offsetCrypto = binPacker.getSize() - startByte
-      binPacker.put(BINARY_CHUNK, self.serializeCryptoParams(), width=256)
+      # Everything up to the root address has a fixed layout, so it is packed
+      # with a single precompiled struct instead of one put() per field.
+      # struct silently truncates 's' fields, keep BinaryPacker's check
+      kdfParams    = self.serializeKdfParams()
+      cryptoParams = self.serializeCryptoParams()
+      for data,width in [[self.fileTypeStr, 8], [self.magicBytes, 4], 
+                         [self.uniqueIDBin, 6], [self.labelName, 32], 
+                         [self.labelDescr, 256], [kdfParams, 256], 
+                         [cryptoParams, 256]]:
+         if len(data) > width:
+            raise PackerError('Too much data to fit into fixed width field')
+
+      binPacker.put(BINARY_CHUNK, WLT_HEADER_STRUCT.pack(
+                                    self.fileTypeStr,
+                                    getVersionInt(self.version),
+                                    self.magicBytes,
+                                    self.getWalletFlags(),
+                                    self.uniqueIDBin,     # firstAddr25bytes[:5][::-1]
+                                    self.wltCreateDate,
+                                    self.labelName,
+                                    self.labelDescr,
+                                    self.highestUsedChainIndex,
+                                    kdfParams,
+                                    cryptoParams))
+
+      self.offsetWltFlags   = WLT_OFFSET_FLAGS
+      self.offsetLabelName  = WLT_OFFSET_LABEL_NAME
+      self.offsetLabelDescr = WLT_OFFSET_LABEL_DESCR
+      self.offsetTopUsed    = WLT_OFFSET_TOP_USED
+      self.offsetKdfParams  = WLT_OFFSET_KDF_PARAMS
+      self.offsetCrypto     = WLT_OFFSET_CRYPTO
 
       # Address-chain root, (base-address for deterministic wallets)
-      self.offsetRootAddr = binPacker.getSize() - startByte
+      self.offsetRootAddr = WLT_OFFSET_ROOT_ADDR
       self.addrMap['ROOT'].walletByteLoc = self.offsetRootAddr
       binPacker.put(BINARY_CHUNK, self.addrMap['ROOT'].serialize())
 
@@ -2055,7 +2326,7 @@ class PyBtcWallet(object):
       # This is the first 4 bytes of the 25-byte address-chain-root address
       # This includes the network byte (i.e. main network, testnet, namecoin)
       self.uniqueIDBin = binUnpacker.get(BINARY_CHUNK, 6)
-      self.uniqueIDB58 = binary_to_base58(self.uniqueIDBin)
+      self.uniqueIDB58 = walletID_to_base58(self.uniqueIDBin)
       self.wltCreateDate  = binUnpacker.get(UINT64)
 
       # We now have both the magic bytes and network byte
@@ -2119,27 +2390,46 @@ class PyBtcWallet(object):
 
    #############################################################################
    def unpackNextEntry(self, binUnpacker):
-      dtype   = binUnpacker.get(UINT8)
+      # Called once per wallet entry on load, so read the entry straight out
+      # of the unpacker's buffer and advance past it once at the end
+      data      = binUnpacker.getBinaryString()
+      pos       = binUnpacker.getPosition()
+      remaining = binUnpacker.getRemainingSize()
+      if remaining < 1:
+         raise UnpackerError
+
+      dtype   = ord(data[pos])
       hashVal = ''
       binData = ''
+      entrySize = 1
       if dtype==WLT_DATATYPE_KEYDATA:
-         hashVal = binUnpacker.get(BINARY_CHUNK, 20)
-         binData = binUnpacker.get(BINARY_CHUNK, self.pybtcaddrSize)
-      elif dtype==WLT_DATATYPE_ADDRCOMMENT:
-         hashVal = binUnpacker.get(BINARY_CHUNK, 20)
-         commentLen = binUnpacker.get(UINT16)
-         binData = binUnpacker.get(BINARY_CHUNK, commentLen)
-      elif dtype==WLT_DATATYPE_TXCOMMENT:
-         hashVal = binUnpacker.get(BINARY_CHUNK, 32)
-         commentLen = binUnpacker.get(UINT16)
-         binData = binUnpacker.get(BINARY_CHUNK, commentLen)
+         entrySize = 21 + self.pybtcaddrSize
+         if remaining < entrySize:
+            raise UnpackerError
+         hashVal = data[pos+1:pos+21]
+         binData = data[pos+21:pos+entrySize]
+      elif dtype in (WLT_DATATYPE_ADDRCOMMENT, WLT_DATATYPE_TXCOMMENT):
+         hdr = WLT_ADDRCOMMENT_HDR_STRUCT
+         if dtype==WLT_DATATYPE_TXCOMMENT:
+            hdr = WLT_TXCOMMENT_HDR_STRUCT
+         if remaining < hdr.size:
+            raise UnpackerError
+         hashVal, commentLen = hdr.unpack_from(data, pos)[1:]
+         entrySize = hdr.size + commentLen
+         if remaining < entrySize:
+            raise UnpackerError
+         binData = data[pos+hdr.size:pos+entrySize]
       elif dtype==WLT_DATATYPE_OPEVAL:
+         # Recovery skips over these, keep it moving past the dtype byte
+         binUnpacker.advance(1)
          raise NotImplementedError('OP_EVAL not support in wallet yet')
       elif dtype==WLT_DATATYPE_DELETED:
-         deletedLen = binUnpacker.get(UINT16)
-         binUnpacker.advance(deletedLen)
-         
+         if remaining < WLT_DELETED_HDR_STRUCT.size:
+            raise UnpackerError
+         deletedLen = WLT_DELETED_HDR_STRUCT.unpack_from(data, pos)[1]
+         entrySize = WLT_DELETED_HDR_STRUCT.size + deletedLen
 
+      binUnpacker.advance(entrySize)
       return (dtype, hashVal, binData)
 
    #############################################################################
@@ -2167,15 +2457,25 @@ class PyBtcWallet(object):
 
       self.lastComputedChainIndex = -UINT32_MAX
       self.lastComputedChainAddr160  = None
+
+      # This loop runs once per wallet entry, keep attribute lookups out of it
+      unpackNextEntry   = self.unpackNextEntry
+      addrMap           = self.addrMap
+      chainIndexMap     = self.chainIndexMap
+      linearAddr160List = self.linearAddr160List
+      importList        = self.importList
+      commentsMap       = self.commentsMap
+      commentLocs       = self.commentLocs
+      totalSize = float(wltdata.getSize())
       i=0
       while wltdata.getRemainingSize()>0:
          byteLocation = wltdata.getPosition()
          i += 1
          if i%10 == 0 and reportProgress is not None:
-            progress = float(byteLocation) / float(wltdata.getSize())
+            progress = float(byteLocation) / totalSize
             reportProgress(progress)
             
-         dtype, hashVal, rawData = self.unpackNextEntry(wltdata)
+         dtype, hashVal, rawData = unpackNextEntry(wltdata)
          if dtype==WLT_DATATYPE_KEYDATA:
             newAddr = PyBtcAddress()
             newAddr.unserialize(rawData)
@@ -2188,24 +2488,30 @@ class PyBtcWallet(object):
                   [WLT_UPDATE_MODIFY, newAddr.walletByteLoc, fixedAddrData]])
             if newAddr.useEncryption:
                newAddr.isLocked = True
-            self.addrMap[hashVal] = newAddr
-            if newAddr.chainIndex > self.lastComputedChainIndex:
-               self.lastComputedChainIndex   = newAddr.chainIndex
-               self.lastComputedChainAddr160 = newAddr.getAddr160()
+            addr160    = newAddr.getAddr160()
+            # Key the map with the address's own string (normally equal),
+            # so the map, list and index all share one object per address
+            if hashVal == addr160:
+               hashVal = addr160
+            addrMap[hashVal] = newAddr
+            chainIndex = newAddr.chainIndex
+            if chainIndex > self.lastComputedChainIndex:
+               self.lastComputedChainIndex   = chainIndex
+               self.lastComputedChainAddr160 = addr160
                
-            if newAddr.chainIndex < -2:
-               newAddr.chainIndex = -2
+            if chainIndex < -2:
+               chainIndex = newAddr.chainIndex = -2
                self.hasNegativeImports = True
                                  
-            self.linearAddr160List.append(newAddr.getAddr160())
-            self.chainIndexMap[newAddr.chainIndex] = newAddr.getAddr160()
+            linearAddr160List.append(addr160)
+            chainIndexMap[chainIndex] = addr160
             
-            if newAddr.chainIndex <= -2:
-               self.importList.append(len(self.linearAddr160List) - 1)
+            if chainIndex <= -2:
+               importList.append(len(linearAddr160List) - 1)
                   
-         if dtype in (WLT_DATATYPE_ADDRCOMMENT, WLT_DATATYPE_TXCOMMENT):
-            self.commentsMap[hashVal] = rawData # actually ASCII data, here
-            self.commentLocs[hashVal] = byteLocation
+         elif dtype in (WLT_DATATYPE_ADDRCOMMENT, WLT_DATATYPE_TXCOMMENT):
+            commentsMap[hashVal] = rawData # actually ASCII data, here
+            commentLocs[hashVal] = byteLocation
          if dtype==WLT_DATATYPE_OPEVAL:
             raise NotImplementedError('OP_EVAL not support in wallet yet')
          if dtype==WLT_DATATYPE_DELETED:
@@ -2293,18 +2599,19 @@ class PyBtcWallet(object):
 
       # Will be passing back info about all data successfully added
       oldWalletSize = os.path.getsize(self.walletPath)
-      updateLocations = []
+      # One location per entry, filled in as the entries are processed
+      updateLocations = [None]*len(updateList)
       dataToChange    = []
       toAppend = BinaryPacker()
 
       try:
-         for entry in updateList:
+         for i,entry in enumerate(updateList):
             modType    = entry[0]
             updateInfo = entry[1:]
 
             if(modType==WLT_UPDATE_ADD):
                dtype = updateInfo[0]
-               updateLocations.append(toAppend.getSize()+oldWalletSize)
+               updateLocations[i] = toAppend.getSize()+oldWalletSize
                if dtype==WLT_DATATYPE_KEYDATA:
                   if len(updateInfo[1])!=20 or not isinstance(updateInfo[2], PyBtcAddress):
                      raise Exception('Data type does not match update type')
@@ -2324,7 +2631,7 @@ class PyBtcWallet(object):
                   raise Exception('OP_EVAL not support in wallet yet')
 
             elif(modType==WLT_UPDATE_MODIFY):
-               updateLocations.append(updateInfo[0])
+               updateLocations[i] = updateInfo[0]
                dataToChange.append( updateInfo )
             else:
                LOGERROR('Unknown wallet-update type!')
@@ -2334,38 +2641,29 @@ class PyBtcWallet(object):
          return []
 
       binaryToAppend = toAppend.getBinaryString()
+      dataToChange = coalesceFileModifications(dataToChange)
 
       # We need to safely modify both the main wallet file and backup
-      # Start with main wallet
+      # Start with main wallet.  The flags only protect us if they reach the
+      # disk before the file they guard is touched, so sync their directory
       touchFile(mainUpdateFlag)
+      syncFileDirectory(mainUpdateFlag)
 
       try:
-         wltfile = open(self.walletPath, 'ab')
-         wltfile.write(binaryToAppend)
-         wltfile.flush()
-         os.fsync(wltfile.fileno())
-         wltfile.close()
-
-         # This is for unit-testing the atomic-wallet-file-update robustness
-         if self.interruptTest1: raise InterruptTestError
-
-         wltfile = open(self.walletPath, 'r+b')
-         for loc,replStr in dataToChange:
-            wltfile.seek(loc)
-            wltfile.write(replStr)
-         wltfile.flush()
-         os.fsync(wltfile.fileno())
-         wltfile.close()
-
+         # The interrupt flag is for unit-testing the atomic-wallet-file-update
+         # robustness:  it stops between the append and the modifications
+         writeWalletFileUpdate(self.walletPath, binaryToAppend, dataToChange,
+                               self.interruptTest1)
       except IOError:
          LOGEXCEPT('Could not write data to wallet.  Permissions?')
-         shutil.copy(walletFileBackup, self.walletPath)
+         copyWalletFile(walletFileBackup, self.walletPath)
          os.remove(mainUpdateFlag)
          return []
 
       # Write backup flag before removing main-update flag.  If we see
       # both flags, we know file IO was interrupted RIGHT HERE
       touchFile(backupUpdateFlag)
+      syncFileDirectory(backupUpdateFlag)
 
       # This is for unit-testing the atomic-wallet-file-update robustness
       if self.interruptTest2: raise InterruptTestError
@@ -2377,23 +2675,18 @@ class PyBtcWallet(object):
          # This is for unit-testing the atomic-wallet-file-update robustness
          if self.interruptTest3: raise InterruptTestError
 
-         backupfile = open(walletFileBackup, 'ab')
-         backupfile.write(binaryToAppend)
-         backupfile.flush()
-         os.fsync(backupfile.fileno())
-         backupfile.close()
-
-         backupfile = open(walletFileBackup, 'r+b')
-         for loc,replStr in dataToChange:
-            backupfile.seek(loc)
-            backupfile.write(replStr)
-         backupfile.flush()
-         os.fsync(backupfile.fileno())
-         backupfile.close()
+         # The main file is now exactly what the backup should become, so
+         # if reflink backups are enabled (WLT_REFLINK_BACKUP) just clone it
+         # instead of replaying the update.  Don't keep trying where that
+         # isn't supported
+         if self.cloneBackupOk:
+            self.cloneBackupOk = cloneWalletFile(self.walletPath, walletFileBackup)
 
+         if not self.cloneBackupOk:
+            writeWalletFileUpdate(walletFileBackup, binaryToAppend, dataToChange)
       except IOError:
          LOGEXCEPT('Could not write backup wallet.  Permissions?')
-         shutil.copy(self.walletPath, walletFileBackup)
+         copyWalletFile(self.walletPath, walletFileBackup)
          os.remove(mainUpdateFlag)
          return []
 
@@ -2442,23 +2735,27 @@ class PyBtcWallet(object):
          # We haven't even created a backup file, yet
          LOGDEBUG('Creating backup file %s', walletFileBackup)
          touchFile(backupUpdateFlag)
-         shutil.copy(self.walletPath, walletFileBackup)
+         copyWalletFile(self.walletPath, walletFileBackup)
          os.remove(backupUpdateFlag)
 
-      if os.path.exists(backupUpdateFlag) and os.path.exists(mainUpdateFlag):
+      # This runs before every wallet update, so stat each flag only once
+      hasMainFlag   = os.path.exists(mainUpdateFlag)
+      hasBackupFlag = os.path.exists(backupUpdateFlag)
+
+      if hasBackupFlag and hasMainFlag:
          # Here we actually have a good main file, but backup never succeeded
          LOGWARN('***WARNING: error in backup file... how did that happen?')
-         shutil.copy(self.walletPath, walletFileBackup)
+         copyWalletFile(self.walletPath, walletFileBackup)
          os.remove(mainUpdateFlag)
          os.remove(backupUpdateFlag)
-      elif os.path.exists(mainUpdateFlag):
+      elif hasMainFlag:
          LOGWARN('***WARNING: last file operation failed!  Restoring wallet from backup')
          # main wallet file might be corrupt, copy from backup
-         shutil.copy(walletFileBackup, self.walletPath)
+         copyWalletFile(walletFileBackup, self.walletPath)
          os.remove(mainUpdateFlag)
-      elif os.path.exists(backupUpdateFlag):
+      elif hasBackupFlag:
          LOGWARN('***WARNING: creation of backup was interrupted -- fixing')
-         shutil.copy(self.walletPath, walletFileBackup)
+         copyWalletFile(self.walletPath, walletFileBackup)
          os.remove(backupUpdateFlag)
 
       if onlySyncBackup:
@@ -2484,23 +2781,33 @@ class PyBtcWallet(object):
       overwriteLoc = self.addrMap[addr160].walletByteLoc - 21
       overwriteLen = 20 + self.pybtcaddrSize - 2
 
-      overwriteBin = ''
-      overwriteBin += int_to_binary(WLT_DATATYPE_DELETED, widthBytes=1)
-      overwriteBin += int_to_binary(overwriteLen,         widthBytes=2)
-      overwriteBin += '\x00'*overwriteLen
+      overwriteBin = WLT_DELETED_HDR_STRUCT.pack(WLT_DATATYPE_DELETED, overwriteLen) + \
+                     '\x00'*overwriteLen
 
       self.walletFileSafeUpdate([[WLT_UPDATE_MODIFY, overwriteLoc, overwriteBin]])
 
       # IMPORTANT:  we need to update the wallet structures to reflect the
-      #             new state of the wallet.  This will actually be easiest
-      #             if we just "forget" the current wallet state and re-read
-      #             the wallet from file
-      wltPath = self.walletPath
-      
-      passCppWallet = self.cppWallet
+      #             new state of the wallet.  Rather than re-reading the whole
+      #             file, drop the entry from memory the same way:  the lists
+      #             are in file order, so the result matches a fresh read
       self.cppWallet.removeAddressBulk([Hash160ToScrAddr(addr160)])
-      self.readWalletFile(wltPath)
-      self.cppWallet = passCppWallet
+
+      del self.addrMap[addr160]
+      self.linearAddr160List.remove(addr160)
+      self.importList = [i for i,a160 in enumerate(self.linearAddr160List) \
+                                    if self.addrMap[a160].chainIndex <= -2]
+
+      # readWalletFile leaves the last import in the file under index -2
+      if self.chainIndexMap.get(-2) == addr160:
+         if len(self.importList) > 0:
+            self.chainIndexMap[-2] = self.linearAddr160List[self.importList[-1]]
+         else:
+            del self.chainIndexMap[-2]
+
+      # getAddrCommentIfAvail caches the tx outputs this wallet owned, which
+      # may include the deleted key.  A fresh read would start empty too
+      self.txAddrMap = {}
+
       self.registerWallet(False)
 
    #############################################################################
@@ -2567,13 +2874,13 @@ class PyBtcWallet(object):
             addr20 = verifyChecksum(addr20, addrChk)
 
       # Now a few sanity checks
-      if self.addrMap.has_key(addr20):
+      if addr20 in self.addrMap:
          LOGWARN('The private key address is already in your wallet!')
          return None
 
       addr20 = computedAddr20
 
-      if self.addrMap.has_key(addr20):
+      if addr20 in self.addrMap:
          LOGERROR('The computed private key address is already in your wallet!')
          return None
 
@@ -2591,15 +2898,15 @@ class PyBtcWallet(object):
                                                          skipCheck=True,
                                                          skipPubCompute=True)
          if self.useEncryption:
-            newAddr.lock(self.kdfKey)
-            newAddr.unlock(self.kdfKey)
+            # The file entry needs the encrypted key, the plaintext can stay
+            newAddr.ensureEncryptedCopy(self.kdfKey)
       elif pubKey:
          securePubKey = SecureBinaryData(pubKey)
          newAddr = PyBtcAddress().createFromPublicKeyData(securePubKey)
       else:
          newAddr = PyBtcAddress().createFromPublicKeyHash160(addr20)
 
-      newAddr.chaincode  = SecureBinaryData('\xff'*32)
+      newAddr.chaincode  = IMPORTED_ADDR_CHAINCODE
       newAddr.chainIndex = -2
       newAddr.timeRange = [firstTime, lastTime]
       newAddr.blkRange  = [firstBlk,  lastBlk ]
@@ -2608,16 +2915,17 @@ class PyBtcWallet(object):
 
       newDataLoc = self.walletFileSafeUpdate( \
          [[WLT_UPDATE_ADD, WLT_DATATYPE_KEYDATA, newAddr160, newAddr]])
-      self.addrMap[newAddr160] = newAddr.copy()
-      self.addrMap[newAddr160].walletByteLoc = newDataLoc[0] + 21
+      walletAddr = newAddr.copy()
+      walletAddr.walletByteLoc = newDataLoc[0] + 21
+      self.addrMap[newAddr160] = walletAddr
       
       self.linearAddr160List.append(newAddr160)
       self.importList.append(len(self.linearAddr160List) - 1)
       
-      if self.useEncryption and self.kdfKey:
-         self.addrMap[newAddr160].lock(self.kdfKey)
-         if not self.isLocked:
-            self.addrMap[newAddr160].unlock(self.kdfKey)
+      # The copy is unlocked with its encrypted key filled in, which is
+      # already the right state unless the wallet itself is locked
+      if self.useEncryption and self.kdfKey and self.isLocked:
+         walletAddr.lock(self.kdfKey)
             
       return computedPubkey
 
@@ -2660,10 +2968,15 @@ class PyBtcWallet(object):
 
       numInputs = len(ustx.pytxObj.inputs)
       wltAddr = []
+      getAddr = self.addrMap.get
       for iin,ustxi in enumerate(ustx.ustxInputs):
          for isig,scrAddr in enumerate(ustxi.scrAddrs):
             addr160 = scrAddr_to_hash160(scrAddr)[1]
-            addrObj = self.getAddrObjectForHash(addr160)
+            # Plain key hashes are addrMap keys.  Only go through the C++
+            # asset lookup for hashes that aren't (i.e. P2SH-wrapped keys)
+            addrObj = getAddr(addr160)
+            if addrObj is None:
+               addrObj = self.getAddrObjectForHash(addr160)
             if addrObj.hasPrivKey():
                wltAddr.append((addrObj, iin, isig))
 
@@ -2800,18 +3113,25 @@ class PyBtcWallet(object):
       #to be able to feed the closest computed address entry to the upcoming, 
       #possibly uncomputed entries.
 
+      #Only those uncomputed entries depend on the entries before them, and
+      #only on their encrypted keys, which unlocking a computed entry doesn't
+      #change.  So they are unlocked here in chain order, and every other
+      #entry is collected and unlocked afterwards, in any order.
+
       naddress = 1
       addrCount = len(self.addrMap)
          
       addrObjPrev = None
-      import operator
-      for addrObj in (sorted(self.addrMap.values(), 
-                             key=operator.attrgetter('chainIndex'))):
-         Progress(naddress, addrCount)
-         naddress = naddress +1
-         
+      plainUnlockList = []
+      for addrObj in self.getAddrListInChainOrder():
          needToSaveAddrAfterUnlock = addrObj.createPrivKeyNextUnlock
-         if needToSaveAddrAfterUnlock and addrObjPrev is not None:
+         if not needToSaveAddrAfterUnlock:
+            plainUnlockList.append(addrObj)
+         else:
+            Progress(naddress, addrCount)
+            naddress = naddress +1
+
+            if addrObjPrev is not None:
                ChainDepth = addrObj.chainIndex - addrObjPrev.chainIndex
 
                if ChainDepth > 0 and addrObjPrev.chainIndex > -1:
@@ -2822,18 +3142,67 @@ class PyBtcWallet(object):
 
                   addrObj.createPrivKeyNextUnlock_ChainDepth  = ChainDepth
 
-         addrObj.unlock(self.kdfKey)
-         if addrObj.chainIndex > -1: addrObjPrev = addrObj
-
-         if needToSaveAddrAfterUnlock:
-            updateLoc = addrObj.walletByteLoc 
+            addrObj.unlock(self.kdfKey)
             self.walletFileSafeUpdate( [[WLT_UPDATE_MODIFY, 
                                          addrObj.walletByteLoc,
                                          addrObj.serialize()]])
 
+         if addrObj.chainIndex > -1: addrObjPrev = addrObj
+
+      # Decrypting a key and checking it against the stored public key happen
+      # in C++, which releases the GIL, so big wallets use a thread pool.  The
+      # first unlock is done alone, so Crypto++ sets up its shared state once
+      kdfKey = self.kdfKey
+      def unlockAddr(addrObj):
+         addrObj.unlock(kdfKey)
+
+      nThreads = WLT_UNLOCK_THREADS
+      if len(plainUnlockList) < WLT_UNLOCK_POOL_MIN_ADDRS or nThreads < 2:
+         poolUnlockList = []
+      else:
+         poolUnlockList = plainUnlockList[1:]
+         plainUnlockList = plainUnlockList[:1]
+
+      for addrObj in plainUnlockList:
+         Progress(naddress, addrCount)
+         naddress = naddress +1
+         unlockAddr(addrObj)
+
+      if len(poolUnlockList) > 0:
+         pool = ThreadPool(nThreads)
+         try:
+            chunkSize = max(1, len(poolUnlockList) // (8*nThreads))
+            for _ in pool.imap_unordered(unlockAddr, poolUnlockList, chunkSize):
+               Progress(naddress, addrCount)
+               naddress = naddress +1
+         finally:
+            pool.terminate()
+            pool.join()
+
       self.isLocked = False
       LOGDEBUG('Unlock succeeded: %s', self.uniqueIDB58)
 
+   ############################################################################
+   def getAddrListInChainOrder(self):
+      """
+      All of addrMap's address objects sorted by chainIndex.  The key order
+      from the last call is reused as long as it still covers addrMap --
+      an object's chainIndex never changes, so a stale order can only come
+      from added or removed entries, which the lookups below catch.
+      """
+      addrList = []
+      if len(self.chainOrderCache) == len(self.addrMap):
+         getAddr = self.addrMap.get
+         addrList = [getAddr(a160) for a160 in self.chainOrderCache]
+
+      if len(addrList) == 0 or any(addrObj is None for addrObj in addrList):
+         # Keyed on the map keys, which aren't all addr160s ('ROOT')
+         self.chainOrderCache = sorted(self.addrMap,
+                              key=lambda a160: self.addrMap[a160].chainIndex)
+         addrList = [self.addrMap[a160] for a160 in self.chainOrderCache]
+
+      return addrList
+
    ############################################################################
    def lock(self, Progress=emptyFunc):
       """
@@ -2894,25 +3263,26 @@ class PyBtcWallet(object):
 
    #############################################################################
    def getAddrListSortedByChainIndex(self, withRoot=False):
-      """ Returns Addr160 list """
-      addrList = []
-      for addr160 in self.linearAddr160List:
-         addr=self.addrMap[addr160]
-         addrList.append( [addr.chainIndex, addr160, addr] )
+      """ 
+      Returns [chainIndex, addr160, addrObj] list.  The sorted order is kept
+      between calls and reused while it still covers linearAddr160List, the
+      same way getAddrListInChainOrder reuses its order.
+      """
+      addrMap = self.addrMap
+      if len(self.linearOrderCache) != len(self.linearAddr160List) or \
+         not all(a160 in addrMap for a160 in self.linearOrderCache):
+         self.linearOrderCache = sorted(self.linearAddr160List,
+                              key=lambda a160: addrMap[a160].chainIndex)
 
-      addrList.sort(key=lambda x: x[0])
-      return addrList
+      return [[addrMap[a160].chainIndex, a160, addrMap[a160]] \
+                                       for a160 in self.linearOrderCache]
 
    #############################################################################
    def getAddrList(self):
       """ Returns list of PyBtcAddress objects """
-      addrList = []
-      for addr160,addrObj in self.addrMap.iteritems():
-         if addr160=='ROOT':
-            continue
-         # I assume these will be references, not copies
-         addrList.append( addrObj )
-      return addrList
+      # I assume these will be references, not copies
+      return [addrObj for addr160,addrObj in self.addrMap.iteritems() \
+                                                       if addr160!='ROOT']
 
 
    #############################################################################
@@ -2921,19 +3291,14 @@ class PyBtcWallet(object):
       Retrieves a list of addresses, by hash, in the order they 
       appear in the wallet file.  Can ignore the imported addresses
       to get only chained addresses, if necessary.
-
-      I could do this with one list comprehension, but it would be long.
-      I'm resisting the urge...
       """
-      addrList = []
-      for a160 in self.linearAddr160List:
-         addr = self.addrMap[a160]
-         if not a160=='ROOT' and (withImported or addr.chainIndex>=0):
-            # Either we want imported addresses, or this isn't one
-            if (withAddrPool or addr.chainIndex<=self.highestUsedChainIndex):
-               addrList.append(addr)
-         
-      return addrList
+      addrMap  = self.addrMap
+      highUsed = self.highestUsedChainIndex
+      # Either we want imported addresses, or this isn't one
+      return [addrMap[a160] for a160 in self.linearAddr160List \
+                 if a160!='ROOT' and \
+                    (withImported or addrMap[a160].chainIndex>=0) and \
+                    (withAddrPool or addrMap[a160].chainIndex<=highUsed)]
 
 
    #############################################################################
@@ -2952,22 +3317,25 @@ class PyBtcWallet(object):
          # would saturate the system's resources and fill the HDD.
          raise WalletAddressError('Chain index is out of range')
 
-      if self.chainIndexMap.has_key(desiredIdx):
-         return self.chainIndexMap[desiredIdx]
+      addr160 = self.chainIndexMap.get(desiredIdx)
+      if addr160 is not None:
+         return addr160
       else:
          # Somehow the address isn't here, even though it is less than the
-         # last computed index
-         closestIdx = 0
-         for idx,addr160 in self.chainIndexMap.iteritems():
-            if closestIdx<idx<=desiredIdx:
-               closestIdx = idx
-               
-         gap = desiredIdx - closestIdx
+         # last computed index.  Walk down to the nearest index we do have,
+         # which costs no more than regenerating the gap afterwards
+         closestIdx = desiredIdx - 1
+         while closestIdx>0 and closestIdx not in self.chainIndexMap:
+            closestIdx -= 1
+         closestIdx = max(closestIdx, 0)
+
+         addrMap = self.addrMap
          extend160 = self.chainIndexMap[closestIdx]
-         for i in range(gap+1):
+         idx = closestIdx
+         while idx < desiredIdx:
             extend160 = self.computeNextAddress(extend160)
-            if desiredIdx==self.addrMap[extend160].chainIndex:
-               return self.chainIndexMap[desiredIdx]
+            idx = addrMap[extend160].chainIndex
+         return self.chainIndexMap.get(desiredIdx)
 
 
    #############################################################################
@@ -2995,16 +3363,17 @@ class PyBtcWallet(object):
 
    #############################################################################
    def isEqualTo(self, wlt2, debug=False):
-      isEqualTo = True
-      isEqualTo = isEqualTo and (self.uniqueIDB58 == wlt2.uniqueIDB58)
-      isEqualTo = isEqualTo and (self.labelName  == wlt2.labelName )
-      isEqualTo = isEqualTo and (self.labelDescr == wlt2.labelDescr)
-      try:
+      if self.uniqueIDB58 != wlt2.uniqueIDB58 or \
+         self.labelName  != wlt2.labelName  or \
+         self.labelDescr != wlt2.labelDescr:
+         return False
 
-         rootstr1 = binary_to_hex(self.addrMap['ROOT'].serialize())
-         rootstr2 = binary_to_hex(wlt2.addrMap['ROOT'].serialize())
-         isEqualTo = isEqualTo and (rootstr1 == rootstr2)
+      try:
+         rootser1 = self.addrMap['ROOT'].serialize()
+         rootser2 = wlt2.addrMap['ROOT'].serialize()
          if debug:
+            rootstr1 = binary_to_hex(rootser1)
+            rootstr2 = binary_to_hex(rootser2)
             print ''
             print 'RootAddrSelf:'
             print prettyHex(rootstr1, indent=' '*5)
@@ -3012,11 +3381,14 @@ class PyBtcWallet(object):
             print prettyHex(rootstr2, indent=' '*5)
             print 'RootAddrDiff:',
             pprintDiff(rootstr1, rootstr2, indent=' '*5)
+         if rootser1 != rootser2:
+            return False
 
-         for addr160 in self.addrMap.keys():
-            addrstr1 = binary_to_hex(self.addrMap[addr160].serialize())
-            addrstr2 = binary_to_hex(wlt2.addrMap[addr160].serialize())
-            isEqualTo = isEqualTo and (addrstr1 == addrstr2)
+         selfAddrMap = self.addrMap
+         wlt2AddrMap = wlt2.addrMap
+         for addr160 in selfAddrMap:
+            addrser1 = selfAddrMap[addr160].serialize()
+            addrser2 = wlt2AddrMap[addr160].serialize()
             if debug:
                print ''
                print 'AddrSelf:', binary_to_hex(addr160),
@@ -3024,11 +3396,13 @@ class PyBtcWallet(object):
                print 'AddrSelf:', binary_to_hex(addr160),
                print prettyHex(binary_to_hex(wlt2.addrMap['ROOT'].serialize()), indent='     ')
                print 'AddrDiff:',
-               pprintDiff(addrstr1, addrstr2, indent=' '*5)
+               pprintDiff(binary_to_hex(addrser1), binary_to_hex(addrser2), indent=' '*5)
+            if addrser1 != addrser2:
+               return False
       except:
          return False
 
-      return isEqualTo
+      return True
 
 
    #############################################################################
@@ -3325,6 +3699,152 @@ def getSuffixedPath(walletPath, nameSuffix):
       fpath = pieces[0] + nameSuffix + pieces[1]
    return fpath
 
+###############################################################################
+# Linux ioctl to share the extents of one file with another (copy-on-write)
+FICLONE = 0x40049409
+WLT_COPY_BUFFER_SIZE = 1 << 20
+
+# Reflink clones are fast, but the clone shares its disk blocks with the
+# original until either is rewritten.  A bad sector or bit-rot in a shared
+# block then hits the wallet and its backup at once, which defeats the point
+# of keeping two copies (see doWalletFileConsistencyCheck).  So wallet files
+# are always copied with real data unless this is switched on
+WLT_REFLINK_BACKUP = False
+
+def copyWalletFile(srcPath, dstPath):
+   """
+   Same result as shutil.copy (data and permission bits), with the data
+   copied in 1 MiB chunks rather than shutil's 16 KiB ones.  With
+   WLT_REFLINK_BACKUP set, filesystems that support it (btrfs, XFS, ...) make
+   a reflink clone instead, so no data goes through user space, but the two
+   files then share their disk blocks.
+   """
+   if os.path.isdir(dstPath):
+      dstPath = os.path.join(dstPath, os.path.basename(srcPath))
+
+   # Opening dstPath for writing would truncate srcPath if they're one file
+   if hasattr(os.path, 'samefile') and os.path.exists(dstPath) and \
+                                       os.path.samefile(srcPath, dstPath):
+      raise shutil.Error('%s and %s are the same file' % (srcPath, dstPath))
+
+   with open(srcPath, 'rb') as srcFile:
+      with open(dstPath, 'wb') as dstFile:
+         cloned = False
+         if WLT_REFLINK_BACKUP and fcntl is not None:
+            try:
+               fcntl.ioctl(dstFile.fileno(), FICLONE, srcFile.fileno())
+               cloned = True
+            except (IOError, OSError):
+               # Not supported here (ENOTTY, EOPNOTSUPP, EXDEV, EINVAL...)
+               pass
+
+         if not cloned:
+            # Read into one reused buffer instead of a new string per chunk
+            copyBuf = bytearray(WLT_COPY_BUFFER_SIZE)
+            copyView = memoryview(copyBuf)
+            while True:
+               nRead = srcFile.readinto(copyBuf)
+               if not nRead:
+                  break
+               dstFile.write(copyView[:nRead])
+
+   shutil.copymode(srcPath, dstPath)
+
+###############################################################################
+def syncFileDirectory(fpath):
+   """
+   fsync the directory holding fpath, so that files created or removed in
+   it are on disk, not just their contents.  Windows can't open a directory
+   as a file, so this is skipped there.
+   """
+   if OS_WINDOWS:
+      return
+
+   try:
+      dirFd = os.open(os.path.dirname(os.path.abspath(fpath)), os.O_RDONLY)
+      try:
+         os.fsync(dirFd)
+      finally:
+         os.close(dirFd)
+   except OSError:
+      # Some network filesystems refuse to fsync a directory
+      LOGWARN('Could not sync directory of %s', fpath)
+
+###############################################################################
+def writeWalletFileUpdate(fpath, binaryToAppend, dataToChange, interrupt=False):
+   """
+   Appends binaryToAppend to the file, then applies the [fileLoc, replStr]
+   overwrites, all through one handle and with one fsync at the end.  A
+   crash part-way through is covered by the update flags the caller sets,
+   so the append doesn't need to hit the disk on its own first.
+   """
+   with open(fpath, 'r+b') as wltfile:
+      wltfile.seek(0, os.SEEK_END)
+      wltfile.write(binaryToAppend)
+
+      if interrupt:
+         raise InterruptTestError
+
+      for loc,replStr in dataToChange:
+         wltfile.seek(loc)
+         wltfile.write(replStr)
+      wltfile.flush()
+      os.fsync(wltfile.fileno())
+
+###############################################################################
+def cloneWalletFile(srcPath, dstPath):
+   """
+   Turns the existing dstPath into a reflink clone of srcPath and syncs it.
+   Returns False, with dstPath left untouched, if WLT_REFLINK_BACKUP is off
+   or the filesystem can't share extents between the two files.  A clone
+   is only as safe as the blocks it shares with srcPath, see above.
+   """
+   if not WLT_REFLINK_BACKUP or fcntl is None:
+      return False
+
+   with open(srcPath, 'rb') as srcFile:
+      # Not 'wb':  if the clone isn't supported, dstPath must stay intact
+      with open(dstPath, 'r+b') as dstFile:
+         try:
+            fcntl.ioctl(dstFile.fileno(), FICLONE, srcFile.fileno())
+         except (IOError, OSError):
+            return False
+
+         # Cloning onto a longer file doesn't shrink it
+         dstFile.truncate(os.fstat(srcFile.fileno()).st_size)
+         dstFile.flush()
+         os.fsync(dstFile.fileno())
+   return True
+
+###############################################################################
+def coalesceFileModifications(dataToChange):
+   """
+   Takes a list of [fileLoc, replStr] overwrites and returns an equivalent
+   list with the writes in file order, and back-to-back writes merged into
+   one.  Re-encrypting a wallet modifies every address entry, which turns
+   thousands of seek+write calls into a handful.  If any two writes
+   overlap, their order matters and the list is returned unchanged.
+   """
+   if len(dataToChange) < 2:
+      return dataToChange
+
+   sortedData = sorted(dataToChange, key=lambda m: m[0])
+   merged = []
+   runStart, runPieces = sortedData[0][0], [sortedData[0][1]]
+   runEnd = runStart + len(sortedData[0][1])
+   for loc,replStr in sortedData[1:]:
+      if loc < runEnd:
+         return dataToChange
+      elif loc == runEnd:
+         runPieces.append(replStr)
+      else:
+         merged.append([runStart, ''.join(runPieces)])
+         runStart, runPieces = loc, [replStr]
+      runEnd = loc + len(replStr)
+
+   merged.append([runStart, ''.join(runPieces)])
+   return merged
+
 
 
 # Putting this at the end because of the circular dependency
@@ -1638,6 +1638,8 @@ class PyBtcWalletRecovery(object):
       newWO.addrMap['ROOT'] = newAddr
       firstAddr = newAddr.extendAddressChain()
       newWO.addrMap[firstAddr.getAddr160()] = firstAddr
+      newWO.linearAddr160List = [firstAddr.getAddr160()]
+      newWO.chainIndexMap[firstAddr.chainIndex] = firstAddr.getAddr160()
       
       newWO.lastComputedChainAddr160 = firstAddr.getAddr160()
       newWO.lastComputedChainIndex  = firstAddr.chainIndex
@@ -1021,27 +1021,41 @@ def generatePreHashTxMsgToSign(pytx, txInIndex, prevTxOutScript, hashcode=1):
       LOGERROR('Requested hashcode=%d' % hashcode)
       return None
 
-   # Create a copy of the tx with all scripts blanked out
-   txCopy = pytx.copyWithoutWitness()
-   for i in range(len(txCopy.inputs)):
-      txCopy.inputs[i].binScript = ''
-
-   # Set the script of the TxIn being signed, to the previous TxOut script
-   txCopy.inputs[txInIndex].binScript = prevTxOutScript
+   # Serialize the tx without witness data straight from its fields, with
+   # every input script blanked except the one being signed, which gets the
+   # previous TxOut script.  Same bytes as blanking the scripts on a copy,
+   # without serializing and re-parsing the whole tx for every input
+   txInList = [(txin, '') for txin in pytx.inputs]
+   txInList[txInIndex] = (pytx.inputs[txInIndex], prevTxOutScript)
+   txOutList = pytx.outputs
    
    # Remove outputs given SIGHASH type (DISABLED DUE TO FIRST CONDITIONAL ABOVE)
    if hashcode & 0x7fffffff == SIGHASH_NONE:
-      txCopy.outputs = []
+      txOutList = []
    elif hashcode & 0x7fffffff == SIGHASH_SINGLE:
-      txCopy.outputs = [txCopy.outputs[txInIndex]]
+      txOutList = [txOutList[txInIndex]]
 
    # Remove all other inputs if needed (DISABLED DUE TO FIRST CONDITIONAL ABOVE)
    if hashcode & SIGHASH_ANYONECANPAY:
-      txCopy.inputs = [txCopy.inputs[txInIndex]]
-
+      txInList = [txInList[txInIndex]]
+
+   binOut = BinaryPacker()
+   binOut.put(UINT32, pytx.version)
+   binOut.put(VAR_INT, len(txInList))
+   for txin,binScript in txInList:
+      binOut.put(BINARY_CHUNK, txin.outpoint.serialize())
+      binOut.put(VAR_INT, len(binScript))
+      binOut.put(BINARY_CHUNK, binScript)
+      binOut.put(UINT32, txin.intSeq)
+   binOut.put(VAR_INT, len(txOutList))
+   for txout in txOutList:
+      binOut.put(BINARY_CHUNK, txout.serialize())
+   binOut.put(UINT32, pytx.lockTime)
+
+   # Packed with the rest, so the tx-sized string is only built once
    hashCode1  = int_to_binary(hashcode, widthBytes=1)
-   hashCode4  = int_to_binary(hashcode, widthBytes=4, endOut=LITTLEENDIAN)
-   preHashMsg = txCopy.serialize() + hashCode4
+   binOut.put(UINT32, hashcode)
+   preHashMsg = binOut.getBinaryString()
    return preHashMsg, hashCode1
 
 
@@ -82,6 +82,7 @@ namespace std
    %template(vector_AddressBookEntry) std::vector<AddressBookEntry>;
    %template(vector_TxBatchRecipient) std::vector<Recipient>;
    %template(vector_TxBatchSpender) std::vector<Spender>;
+   %template(vector_SecureBinaryData) std::vector<SecureBinaryData>;
 }
 
 %exception
@@ -134,6 +134,35 @@ void KdfRomix::computeKdfParams(double targetComputeSec, uint32_t maxMemReqts)
    // Start the search for a memory value at 1kB
    memoryReqtBytes_ = 1024;
    double approxSec = 0;
+
+   // Doubling all the way up from 1kB costs about as much again as the final
+   // probe.  ROMix time is roughly linear in the table size, so time a single
+   // pass over a 1MB table and skip ahead to a couple of doublings short of
+   // the extrapolated target.  We leave some slack there since the 1MB table
+   // still sits in cache and will underestimate the cost of larger ones.  
+   // The search below then finishes on real measurements, as before.
+   uint32_t const calibrationBytes = 1024*1024;
+   if(calibrationBytes < maxMemReqts)
+   {
+      memoryReqtBytes_ = calibrationBytes;
+      sequenceCount_ = memoryReqtBytes_ / hashOutputBytes_;
+      lookupTable_.resize(memoryReqtBytes_);
+
+      TIMER_RESTART("KDF_Mem_Calibrate");
+      testKey = DeriveKey_OneIter(testKey);
+      TIMER_STOP("KDF_Mem_Calibrate");
+      double calibrationSec = TIMER_READ_SEC("KDF_Mem_Calibrate");
+
+      double targetBytes = calibrationBytes;
+      if(calibrationSec > 0)
+         targetBytes *= (targetComputeSec/4) / calibrationSec;
+
+      memoryReqtBytes_ = 1024;
+      while((double)memoryReqtBytes_*4 <= targetBytes && 
+            memoryReqtBytes_*2 < maxMemReqts)
+         memoryReqtBytes_ *= 2;
+   }
+
    while(approxSec <= targetComputeSec/4 && memoryReqtBytes_ < maxMemReqts)
    {
       memoryReqtBytes_ *= 2;
@@ -210,15 +239,56 @@ void KdfRomix::printKdfParams(void)
 
 /////////////////////////////////////////////////////////////////////////////
 SecureBinaryData KdfRomix::DeriveKey_OneIter(SecureBinaryData const & password)
+{
+   // Prepare the lookup table
+   lookupTable_.resize(memoryReqtBytes_);
+   lookupTable_.fill(0);
+
+   SecureBinaryData result = DeriveKey_OneIter_NoAlloc(password);
+   lookupTable_.destroy();
+   return result;
+}
+
+/////////////////////////////////////////////////////////////////////////////
+// SHA-512 of exactly 64 bytes.  Such a message always pads out to a single
+// 128-byte block with a fixed tail, so we build that block directly and run
+// one compression on it, instead of going through the buffering and padding
+// of HashTransformation::CalculateDigest.  Every hash in the ROMix loops
+// below (except the initial salted-password hash) is of this shape.
+static void sha512_64Bytes(uint8_t* digest, uint8_t const * data)
+{
+   CRYPTOPP_ALIGN_DATA(16) CryptoPP::word64 block[16];
+   CRYPTOPP_ALIGN_DATA(16) CryptoPP::word64 state[8];
+
+   for(uint32_t i=0; i<8; i++)
+      block[i] = CryptoPP::GetWord<CryptoPP::word64>(
+                              false, CryptoPP::BIG_ENDIAN_ORDER, data + 8*i);
+
+   // 0x80 terminator, zero fill and the 128-bit message length (512 bits)
+   block[8] = W64LIT(0x8000000000000000);
+   for(uint32_t i=9; i<15; i++)
+      block[i] = 0;
+   block[15] = 512;
+
+   CryptoPP::SHA512::InitState(state);
+   CryptoPP::SHA512::Transform(state, block);
+
+   for(uint32_t i=0; i<8; i++)
+      CryptoPP::PutWord<CryptoPP::word64>(
+                       false, CryptoPP::BIG_ENDIAN_ORDER, digest + 8*i, state[i]);
+}
+
+/////////////////////////////////////////////////////////////////////////////
+SecureBinaryData KdfRomix::DeriveKey_OneIter_NoAlloc(
+   SecureBinaryData const & password)
 {
    CryptoPP::SHA512 sha512;
 
    // Concatenate the salt/IV to the password
    SecureBinaryData saltedPassword = password + salt_; 
-   
-   // Prepare the lookup table
-   lookupTable_.resize(memoryReqtBytes_);
-   lookupTable_.fill(0);
+
+   // Every byte of the table that is read below is written by the hash
+   // chain first, so there is no need to clear it between iterations
    uint32_t const HSZ = hashOutputBytes_;
    uint8_t* frontOfLUT = lookupTable_.getPtr();
    uint8_t* nextRead  = NULL;
@@ -236,7 +306,7 @@ SecureBinaryData KdfRomix::DeriveKey_OneIter(SecureBinaryData const & password)
       // Compute hash of slot i, put result in slot i+1
       nextRead  = frontOfLUT + nByte;
       nextWrite = nextRead + hashOutputBytes_;
-      sha512.CalculateDigest(nextWrite, nextRead, hashOutputBytes_);
+      sha512_64Bytes(nextWrite, nextRead);
    }
 
    // LookupTable should be complete, now start lookup sequence.
@@ -272,23 +342,49 @@ SecureBinaryData KdfRomix::DeriveKey_OneIter(SecureBinaryData const & password)
          *(Y64ptr+i) = *(X64ptr+i) ^ *(V64ptr+i);
 
       // Hash the xor'd data to get the next index for lookup
-      sha512.CalculateDigest(X.getPtr(), Y.getPtr(), HSZ);
+      sha512_64Bytes(X.getPtr(), Y.getPtr());
    }
    // Truncate the final result to get the final key
-   lookupTable_.destroy();
    return X.getSliceCopy(0,kdfOutputBytes_);
 }
 
 /////////////////////////////////////////////////////////////////////////////
 SecureBinaryData KdfRomix::DeriveKey(SecureBinaryData const & password)
 {
+   lookupTable_.resize(memoryReqtBytes_);
+   lookupTable_.fill(0);
+
    SecureBinaryData masterKey(password);
    for(uint32_t i=0; i<numIterations_; i++)
-      masterKey = DeriveKey_OneIter(masterKey);
+      masterKey = DeriveKey_OneIter_NoAlloc(masterKey);
    
+   lookupTable_.destroy();
    return SecureBinaryData(masterKey);
 }
 
+/////////////////////////////////////////////////////////////////////////////
+vector<SecureBinaryData> KdfRomix::DeriveKeys(
+   vector<SecureBinaryData> const & passwords)
+{
+   vector<SecureBinaryData> masterKeys;
+   masterKeys.reserve(passwords.size());
+
+   lookupTable_.resize(memoryReqtBytes_);
+   lookupTable_.fill(0);
+
+   for(auto const & password : passwords)
+   {
+      SecureBinaryData masterKey(password);
+      for(uint32_t i=0; i<numIterations_; i++)
+         masterKey = DeriveKey_OneIter_NoAlloc(masterKey);
+
+      masterKeys.push_back(masterKey);
+   }
+
+   lookupTable_.destroy();
+   return masterKeys;
+}
+
 
 
 
@@ -833,32 +929,19 @@ SecureBinaryData CryptoECDSA::ComputeChainedPublicKey(
       cout << "   BinPub: " << binPubKey.toHexStr() << endl;
       cout << "   BinChn: " << chainCode.toHexStr() << endl;
    }
-   static SecureBinaryData SECP256K1_ORDER_BE = SecureBinaryData::CreateFromHex(
-           "fffffffffffffffffffffffffffffffebaaedce6af48a03bbfd25e8cd0364141");
 
-   // Added extra entropy to chaincode by xor'ing with hash256 of pubkey
-   BinaryData chainMod  = binPubKey.getHash256();
-   BinaryData chainOrig = chainCode.getRawCopy();
-   BinaryData chainXor(32);
-      
-   for(uint8_t i=0; i<8; i++)
-   {
-      uint8_t offset = 4*i;
-      *(uint32_t*)(chainXor.getPtr()+offset) =
-                           *(uint32_t*)( chainMod.getPtr()+offset) ^ 
-                           *(uint32_t*)(chainOrig.getPtr()+offset);
-   }
+   BinaryData chainXor = ComputeChainMultiplier(binPubKey, chainCode);
 
    // Parse the chaincode as a big-endian integer
    CryptoPP::Integer mult;
    mult.Decode(chainXor.getPtr(), chainXor.getSize(), UNSIGNED);
 
-   // "new" init as "old", to make sure it's initialized on the correct curve
-   BTC_PUBKEY oldPubKey = ParsePublicKey(binPubKey); 
-   BTC_PUBKEY newPubKey = ParsePublicKey(binPubKey);
+   // ParsePublicKey validates the point, which is not cheap, so only do it
+   // once and write the new point into the same (already initialized) key
+   BTC_PUBKEY pubKey = ParsePublicKey(binPubKey); 
 
    // Let Crypto++ do the EC math for us, serialize the new public key
-   newPubKey.SetPublicElement( oldPubKey.ExponentiatePublicElement(mult) );
+   pubKey.SetPublicElement( pubKey.ExponentiatePublicElement(mult) );
 
    if(multiplierOut != NULL)
       (*multiplierOut) = SecureBinaryData(chainXor);
@@ -869,7 +952,57 @@ SecureBinaryData CryptoECDSA::ComputeChainedPublicKey(
    //LOGINFO << "   Chaincode:  " << chainOrig.toHexStr().c_str();
    //LOGINFO << "   Multiplier: " << chainXor.toHexStr().c_str();
 
-   return CryptoECDSA::SerializePublicKey(newPubKey);
+   return CryptoECDSA::SerializePublicKey(pubKey);
+}
+
+////////////////////////////////////////////////////////////////////////////////
+vector<SecureBinaryData> CryptoECDSA::ComputeChainedPublicKeys(
+                                SecureBinaryData const & binPubKey,
+                                SecureBinaryData const & chainCode,
+                                uint32_t count)
+{
+   vector<SecureBinaryData> pubKeys;
+   pubKeys.reserve(count);
+
+   // Only the starting key comes from the outside and needs validating.
+   // Every following point is a multiple of it, so we keep working on the
+   // Crypto++ object and only serialize to hash it for the next multiplier
+   BTC_PUBKEY pubKey = ParsePublicKey(binPubKey);
+   SecureBinaryData prevPubKey(binPubKey);
+   CryptoPP::Integer mult;
+
+   for(uint32_t i=0; i<count; i++)
+   {
+      BinaryData chainXor = ComputeChainMultiplier(prevPubKey, chainCode);
+      mult.Decode(chainXor.getPtr(), chainXor.getSize(), UNSIGNED);
+
+      pubKey.SetPublicElement( pubKey.ExponentiatePublicElement(mult) );
+      prevPubKey = CryptoECDSA::SerializePublicKey(pubKey);
+      pubKeys.push_back(prevPubKey);
+   }
+
+   return pubKeys;
+}
+
+////////////////////////////////////////////////////////////////////////////////
+BinaryData CryptoECDSA::ComputeChainMultiplier(
+                                SecureBinaryData const & binPubKey,
+                                SecureBinaryData const & chainCode)
+{
+   // Added extra entropy to chaincode by xor'ing with hash256 of pubkey
+   BinaryData chainMod  = binPubKey.getHash256();
+   BinaryData chainOrig = chainCode.getRawCopy();
+   BinaryData chainXor(32);
+      
+   for(uint8_t i=0; i<8; i++)
+   {
+      uint8_t offset = 4*i;
+      *(uint32_t*)(chainXor.getPtr()+offset) =
+                           *(uint32_t*)( chainMod.getPtr()+offset) ^ 
+                           *(uint32_t*)(chainOrig.getPtr()+offset);
+   }
+
+   return chainXor;
 }
 
 ////////////////////////////////////////////////////////////////////////////////
@@ -250,6 +250,13 @@ public:
    /////////////////////////////////////////////////////////////////////////////
    SecureBinaryData DeriveKey(SecureBinaryData const & password);
 
+   /////////////////////////////////////////////////////////////////////////////
+   // Same as DeriveKey, for a list of candidate passwords.  The lookup table
+   // is allocated (and mlock'd) once for the whole batch instead of once per
+   // iteration per password
+   vector<SecureBinaryData> DeriveKeys(
+      vector<SecureBinaryData> const & passwords);
+
    /////////////////////////////////////////////////////////////////////////////
    string       getHashFunctionName(void) const { return hashFunctionName_; }
    uint32_t     getMemoryReqtBytes(void) const  { return memoryReqtBytes_; }
@@ -258,6 +265,12 @@ public:
    
 private:
 
+   /////////////////////////////////////////////////////////////////////////////
+   // This is the ROMix pass itself, lookupTable_ must already be sized to
+   // memoryReqtBytes_. The table is not wiped here, the caller does it once
+   // it is done with all its iterations
+   SecureBinaryData DeriveKey_OneIter_NoAlloc(SecureBinaryData const & password);
+
    string   hashFunctionName_;  // name of hash function to use (only one)
    uint32_t hashOutputBytes_;
    uint32_t kdfOutputBytes_;    // size of final key data
@@ -423,6 +436,20 @@ public:
                            SecureBinaryData const & chainCode,
                            SecureBinaryData* multiplierOut=NULL);
 
+   /////////////////////////////////////////////////////////////////////////////
+   // Walk <count> steps down the public key chain in a single call, returns
+   // the new keys in chain order (binPubKey itself is not included)
+   vector<SecureBinaryData> ComputeChainedPublicKeys(
+                           SecureBinaryData const & binPubKey,
+                           SecureBinaryData const & chainCode,
+                           uint32_t count);
+
+   /////////////////////////////////////////////////////////////////////////////
+   // hash256(pubkey) XOR chaincode, the scalar used for one chain step
+   BinaryData ComputeChainMultiplier(
+                           SecureBinaryData const & binPubKey,
+                           SecureBinaryData const & chainCode);
+
    /////////////////////////////////////////////////////////////////////////////
    // We need some direct access to Crypto++ math functions
    SecureBinaryData InvMod(const SecureBinaryData& m);
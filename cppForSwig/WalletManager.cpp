@@ -201,7 +201,7 @@ void WalletContainer::registerWithBDV(bool isNew)
 int WalletContainer::detectHighestUsedIndex()
 {
    int topIndex = 0;
-   for (auto addrCountPair : countMap_)
+   for (auto& addrCountPair : countMap_)
    {
       auto& addr = addrCountPair.first;
       auto index = getAssetIndexForAddr(addr);
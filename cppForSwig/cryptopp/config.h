@@ -120,6 +120,14 @@ const lword LWORD_MAX = W64LIT(0xffffffffffffffff);
 	#define CRYPTOPP_GCC_VERSION (__GNUC__ * 10000 + __GNUC_MINOR__ * 100 + __GNUC_PATCHLEVEL__)
 #endif
 
+// clang reports itself as GCC 4.2.1, so its real version is tracked separately.
+// Apple ships its own clang numbering, which does not match the LLVM releases.
+#if defined(__clang__) && defined(__apple_build_version__)
+	#define CRYPTOPP_APPLE_CLANG_VERSION (__clang_major__ * 10000 + __clang_minor__ * 100 + __clang_patchlevel__)
+#elif defined(__clang__)
+	#define CRYPTOPP_LLVM_CLANG_VERSION (__clang_major__ * 10000 + __clang_minor__ * 100 + __clang_patchlevel__)
+#endif
+
 // define hword, word, and dword. these are used for multiprecision integer arithmetic
 // Intel compiler won't have _umul128 until version 10.0. See http://softwarecommunity.intel.com/isn/Community/en-US/forums/thread/30231625.aspx
 #if (defined(_MSC_VER) && (!defined(__INTEL_COMPILER) || __INTEL_COMPILER >= 1000) && (defined(_M_X64) || defined(_M_IA64))) || (defined(__DECCXX) && defined(__alpha__)) || (defined(__INTEL_COMPILER) && defined(__x86_64__)) || (defined(__SUNPRO_CC) && defined(__x86_64__))
@@ -295,6 +303,18 @@ NAMESPACE_END
 	#define CRYPTOPP_BOOL_AESNI_INTRINSICS_AVAILABLE 0
 #endif
 
+// The SHA extension rounds are compiled with a per-function target attribute,
+// so no -msha build flag is needed.  sha.cpp picks them at runtime with HasSHA()
+// clang only accepts the SHA intrinsics inside target("sha") functions from
+// LLVM 3.8 (Xcode 8 on macOS); older clangs reject them without -msha.
+#if !defined(CRYPTOPP_DISABLE_SHANI) && (defined(CRYPTOPP_X86_ASM_AVAILABLE) || defined(CRYPTOPP_X64_MASM_AVAILABLE)) && \
+	((CRYPTOPP_GCC_VERSION >= 40900 && !defined(__clang__)) || CRYPTOPP_LLVM_CLANG_VERSION >= 30800 || \
+	 CRYPTOPP_APPLE_CLANG_VERSION >= 80000 || (defined(_MSC_VER) && _MSC_VER >= 1900))
+	#define CRYPTOPP_BOOL_SHANI_INTRINSICS_AVAILABLE 1
+#else
+	#define CRYPTOPP_BOOL_SHANI_INTRINSICS_AVAILABLE 0
+#endif
+
 #if CRYPTOPP_BOOL_SSE2_INTRINSICS_AVAILABLE || CRYPTOPP_BOOL_SSE2_ASM_AVAILABLE || defined(CRYPTOPP_X64_MASM_AVAILABLE)
 	#define CRYPTOPP_BOOL_ALIGN16_ENABLED 1
 #else
@@ -25,7 +25,11 @@ NAMESPACE_BEGIN(CryptoPP)
 
 bool CpuId(word32 input, word32 *output)
 {
+#if _MSC_VER >= 1500
+	__cpuidex((int *)output, input, 0);
+#else
 	__cpuid((int *)output, input);
+#endif
 	return true;
 }
 
@@ -57,6 +61,7 @@ bool CpuId(word32 input, word32 *output)
 		__asm
 		{
 			mov eax, input
+			xor ecx, ecx
 			cpuid
 			mov edi, output
 			mov [edi], eax
@@ -89,7 +94,7 @@ bool CpuId(word32 input, word32 *output)
 			"pushq %%rbx; cpuid; mov %%ebx, %%edi; popq %%rbx"
 #endif
 			: "=a" (output[0]), "=D" (output[1]), "=c" (output[2]), "=d" (output[3])
-			: "a" (input)
+			: "a" (input), "2" (0)
 		);
 	}
 
@@ -143,7 +148,7 @@ static bool TrySSE2()
 }
 
 bool g_x86DetectionDone = false;
-bool g_hasISSE = false, g_hasSSE2 = false, g_hasSSSE3 = false, g_hasMMX = false, g_hasAESNI = false, g_hasCLMUL = false, g_isP4 = false;
+bool g_hasISSE = false, g_hasSSE2 = false, g_hasSSSE3 = false, g_hasMMX = false, g_hasAESNI = false, g_hasCLMUL = false, g_hasSHA = false, g_isP4 = false;
 word32 g_cacheLineSize = CRYPTOPP_L1_CACHE_LINE_SIZE;
 
 void DetectX86Features()
@@ -161,6 +166,14 @@ void DetectX86Features()
 	g_hasAESNI = g_hasSSE2 && (cpuid1[2] & (1<<25));
 	g_hasCLMUL = g_hasSSE2 && (cpuid1[2] & (1<<1));
 
+	// The SHA rounds also use SSSE3 and SSE4.1 (bit 19) instructions
+	if (cpuid[0] >= 7 && g_hasSSSE3 && (cpuid1[2] & (1<<19)))
+	{
+		word32 cpuid7[4];
+		if (CpuId(7, cpuid7))
+			g_hasSHA = (cpuid7[1] & (1<<29)) != 0;
+	}
+
 	if ((cpuid1[3] & (1 << 25)) != 0)
 		g_hasISSE = true;
 	else
@@ -105,6 +105,7 @@ extern CRYPTOPP_DLL bool g_x86DetectionDone;
 extern CRYPTOPP_DLL bool g_hasSSSE3;
 extern CRYPTOPP_DLL bool g_hasAESNI;
 extern CRYPTOPP_DLL bool g_hasCLMUL;
+extern CRYPTOPP_DLL bool g_hasSHA;
 extern CRYPTOPP_DLL bool g_isP4;
 extern CRYPTOPP_DLL word32 g_cacheLineSize;
 CRYPTOPP_DLL void CRYPTOPP_API DetectX86Features();
@@ -164,6 +165,13 @@ inline bool HasCLMUL()
 	return g_hasCLMUL;
 }
 
+inline bool HasSHA()
+{
+	if (!g_x86DetectionDone)
+		DetectX86Features();
+	return g_hasSHA;
+}
+
 inline bool IsP4()
 {
 	if (!g_x86DetectionDone)
@@ -14,6 +14,10 @@
 #include "misc.h"
 #include "cpu.h"
 
+#if CRYPTOPP_BOOL_SHANI_INTRINSICS_AVAILABLE
+#include <immintrin.h>
+#endif
+
 NAMESPACE_BEGIN(CryptoPP)
 
 // start of Steve Reid's code
@@ -119,6 +123,70 @@ extern const word32 SHA256_K[64] = {
 	0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2
 };
 
+#if CRYPTOPP_BOOL_SHANI_INTRINSICS_AVAILABLE
+
+#if defined(__GNUC__)
+#define CRYPTOPP_SHANI_FUNCTION __attribute__((target("sha,sse4.1")))
+#else
+#define CRYPTOPP_SHANI_FUNCTION
+#endif
+
+// SHA-256 rounds with the Intel SHA extensions.  Like X86_SHA256_HashBlocks,
+// data is the raw (big endian) message and length is a multiple of BLOCKSIZE.
+CRYPTOPP_SHANI_FUNCTION
+static void SHA256_SHANI_HashBlocks(word32 *state, const word32 *data, size_t length)
+{
+	const __m128i MASK = _mm_set_epi64x(W64LIT(0x0c0d0e0f08090a0b), W64LIT(0x0405060700010203));
+
+	// Load state as ABEF / CDGH, the layout sha256rnds2 works on
+	__m128i TMP    = _mm_loadu_si128((const __m128i*)&state[0]);
+	__m128i STATE1 = _mm_loadu_si128((const __m128i*)&state[4]);
+	TMP    = _mm_shuffle_epi32(TMP, 0xB1);
+	STATE1 = _mm_shuffle_epi32(STATE1, 0x1B);
+	__m128i STATE0 = _mm_alignr_epi8(TMP, STATE1, 8);
+	STATE1 = _mm_blend_epi16(STATE1, TMP, 0xF0);
+
+	for (; length >= 64; length -= 64, data += 16)
+	{
+		const __m128i ABEF_SAVE = STATE0;
+		const __m128i CDGH_SAVE = STATE1;
+		__m128i MSG[4];
+
+		for (unsigned int i=0; i<16; i++)
+		{
+			__m128i &W = MSG[i&3];
+			if (i < 4)
+				W = _mm_shuffle_epi8(_mm_loadu_si128((const __m128i*)(data+4*i)), MASK);
+			else
+			{
+				// W[i] = msg2(msg1(W[i-4], W[i-3]) + W[i-1:i-2 shifted], W[i-1])
+				TMP = _mm_alignr_epi8(MSG[(i+3)&3], MSG[(i+2)&3], 4);
+				W = _mm_sha256msg1_epu32(W, MSG[(i+1)&3]);
+				W = _mm_add_epi32(W, TMP);
+				W = _mm_sha256msg2_epu32(W, MSG[(i+3)&3]);
+			}
+
+			TMP = _mm_add_epi32(W, _mm_loadu_si128((const __m128i*)(SHA256_K+4*i)));
+			STATE1 = _mm_sha256rnds2_epu32(STATE1, STATE0, TMP);
+			TMP = _mm_shuffle_epi32(TMP, 0x0E);
+			STATE0 = _mm_sha256rnds2_epu32(STATE0, STATE1, TMP);
+		}
+
+		STATE0 = _mm_add_epi32(STATE0, ABEF_SAVE);
+		STATE1 = _mm_add_epi32(STATE1, CDGH_SAVE);
+	}
+
+	// Back to ABCD / EFGH
+	TMP    = _mm_shuffle_epi32(STATE0, 0x1B);
+	STATE1 = _mm_shuffle_epi32(STATE1, 0xB1);
+	STATE0 = _mm_blend_epi16(TMP, STATE1, 0xF0);
+	STATE1 = _mm_alignr_epi8(STATE1, TMP, 8);
+	_mm_storeu_si128((__m128i*)&state[0], STATE0);
+	_mm_storeu_si128((__m128i*)&state[4], STATE1);
+}
+
+#endif	// #if CRYPTOPP_BOOL_SHANI_INTRINSICS_AVAILABLE
+
 #endif // #ifndef CRYPTOPP_GENERATE_X64_MASM
 
 #if defined(CRYPTOPP_X86_ASM_AVAILABLE) || defined(CRYPTOPP_GENERATE_X64_MASM)
@@ -450,12 +518,26 @@ void CRYPTOPP_FASTCALL X86_SHA256_HashBlocks(word32 *state, const word32 *data,
 
 size_t SHA256::HashMultipleBlocks(const word32 *input, size_t length)
 {
+#if CRYPTOPP_BOOL_SHANI_INTRINSICS_AVAILABLE
+	if (HasSHA())
+	{
+		SHA256_SHANI_HashBlocks(m_state, input, length&(size_t(0)-BLOCKSIZE));
+		return length % BLOCKSIZE;
+	}
+#endif
 	X86_SHA256_HashBlocks(m_state, input, (length&(size_t(0)-BLOCKSIZE)) - !HasSSE2());
 	return length % BLOCKSIZE;
 }
 
 size_t SHA224::HashMultipleBlocks(const word32 *input, size_t length)
 {
+#if CRYPTOPP_BOOL_SHANI_INTRINSICS_AVAILABLE
+	if (HasSHA())
+	{
+		SHA256_SHANI_HashBlocks(m_state, input, length&(size_t(0)-BLOCKSIZE));
+		return length % BLOCKSIZE;
+	}
+#endif
 	X86_SHA256_HashBlocks(m_state, input, (length&(size_t(0)-BLOCKSIZE)) - !HasSSE2());
 	return length % BLOCKSIZE;
 }
@@ -491,6 +573,13 @@ void SHA256::Transform(word32 *state, const word32 *data)
 #if defined(CRYPTOPP_X86_ASM_AVAILABLE) || defined(CRYPTOPP_X64_MASM_AVAILABLE)
 	// this byte reverse is a waste of time, but this function is only called by MDC
 	ByteReverse(W, data, BLOCKSIZE);
+#if CRYPTOPP_BOOL_SHANI_INTRINSICS_AVAILABLE
+	if (HasSHA())
+	{
+		SHA256_SHANI_HashBlocks(state, W, BLOCKSIZE);
+		return;
+	}
+#endif
 	X86_SHA256_HashBlocks(state, W, BLOCKSIZE - !HasSSE2());
 #else
 	word32 T[8];
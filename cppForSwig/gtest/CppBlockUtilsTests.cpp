@@ -30,6 +30,7 @@
 #include "../BtcWallet.h"
 #include "../BlockDataViewer.h"
 #include "../cryptopp/DetSign.h"
+#include "../cryptopp/cpu.h"
 #include "../cryptopp/integer.h"
 #include "../Progress.h"
 #include "../reorgTest/blkdata.h"
@@ -739,6 +740,91 @@ TEST_F(CryptoPPTest, DetSigning)
 
 }
 
+////////////////////////////////////////////////////////////////////////////////
+// Known answers recorded from the KdfRomix implementation that allocated and
+// zeroed the lookup table on every iteration. DeriveKey and the DeriveKeys
+// batch path must both keep reproducing them.
+TEST_F(CryptoPPTest, KdfRomixKnownAnswer)
+{
+   SecureBinaryData salt = SecureBinaryData::CreateFromHex(
+      "4d8f5ec5be9b0e23f1c8ed6a36ca9c60ebdd05337acb20bd6bbc86b6e1c7e4e1");
+   SecureBinaryData pass1((uint8_t const*)"This is my passphrase", 21);
+   SecureBinaryData pass2((uint8_t const*)"Correct horse battery staple", 28);
+
+   SecureBinaryData expect1 = SecureBinaryData::CreateFromHex(
+      "534a640701c6957b5fa0800279496152cdc8adae1e26754b7ba39527da6f6ce6");
+   SecureBinaryData expect2 = SecureBinaryData::CreateFromHex(
+      "bc4e7d8790a8e49b905db6747f7f3188c860ee1c00fd3c3a48aea61092433ae1");
+   SecureBinaryData expect3 = SecureBinaryData::CreateFromHex(
+      "978293c289eac8aa017aab23a0a08a2b551820aadd873e79108d9449ac7567cc");
+
+   // 16 kB, 3 iterations
+   KdfRomix kdf(16384, 3, salt);
+   EXPECT_EQ(kdf.DeriveKey(pass1), expect1);
+   EXPECT_EQ(kdf.DeriveKey(pass2), expect2);
+
+   // 1 kB, 1 iteration
+   KdfRomix kdfSmall(1024, 1, salt);
+   EXPECT_EQ(kdfSmall.DeriveKey(pass1), expect3);
+
+   vector<SecureBinaryData> passwords;
+   passwords.push_back(pass1);
+   passwords.push_back(pass2);
+   passwords.push_back(pass1);
+   vector<SecureBinaryData> keys = kdf.DeriveKeys(passwords);
+   ASSERT_EQ(keys.size(), 3);
+   EXPECT_EQ(keys[0], expect1);
+   EXPECT_EQ(keys[1], expect2);
+   EXPECT_EQ(keys[2], expect1);
+
+   // The same object must still answer correctly after a batch
+   EXPECT_EQ(kdf.DeriveKey(pass2), expect2);
+}
+
+////////////////////////////////////////////////////////////////////////////////
+// FIPS 180-2 SHA-256 vectors. On CPUs with the SHA extensions these go
+// through the SHA-NI rounds, otherwise through the portable/SSE2 code.
+TEST_F(CryptoPPTest, SHA256KnownAnswer)
+{
+   if (CryptoPP::HasSHA())
+      cout << "SHA-256 using the SHA extensions" << endl;
+
+   string msg1 = "abc";
+   string msg2 = "abcdbcdecdefdefgefghfghighijhijkijkljklmklmnlmnomnopnopq";
+   SecureBinaryData digest(32);
+
+   CryptoPP::SHA256().CalculateDigest(digest.getPtr(), NULL, 0);
+   EXPECT_EQ(digest.toHexStr(),
+      "e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855");
+
+   CryptoPP::SHA256().CalculateDigest(digest.getPtr(),
+      (uint8_t const*)msg1.c_str(), msg1.size());
+   EXPECT_EQ(digest.toHexStr(),
+      "ba7816bf8f01cfea414140de5dae2223b00361a396177a9cb410ff61f20015ad");
+
+   CryptoPP::SHA256().CalculateDigest(digest.getPtr(),
+      (uint8_t const*)msg2.c_str(), msg2.size());
+   EXPECT_EQ(digest.toHexStr(),
+      "248d6a61d20638b8e5c026930c3e6039a33ce45964ff2167f6ecedd419db06c1");
+
+   // One million 'a', fed in uneven pieces so both the multi-block and the
+   // buffered partial-block paths are used
+   string chunk(999, 'a');
+   CryptoPP::SHA256 sha256;
+   for (uint32_t i = 0; i < 1001; i++)
+      sha256.Update((uint8_t const*)chunk.c_str(), chunk.size());
+   sha256.Update((uint8_t const*)chunk.c_str(), 1000000 - 999 * 1001);
+   sha256.Final(digest.getPtr());
+   EXPECT_EQ(digest.toHexStr(),
+      "cdc76e5c9914fb9281a1c7e284d73e67f1809a48a497200e046d39ccc7112cd0");
+
+   // Double SHA-256 through BtcUtils, as used for block and tx hashes
+   BinaryData hash256 = BtcUtils::getHash256(
+      (uint8_t const*)msg1.c_str(), msg1.size());
+   EXPECT_EQ(hash256.toHexStr(),
+      "4f8b42c22dd3729b519ba6f68d2da7cc5b2d606d05daed5ad5128cc03e6c6358");
+}
+
 
 ////////////////////////////////////////////////////////////////////////////////
 class BinaryDataTest : public ::testing::Test
@@ -12,9 +12,12 @@ from armoryengine.PyBtcWallet import PyBtcWallet
 from armoryengine.ArmoryUtils import RightNow
 from CppBlockUtils import SecureBinaryData
 from operator import add, mul
+from itertools import islice
 # Give an upper limit for any method to return
 # if the limit is exceded raise MaxResultsExceeded exception
 MAX_LIST_LEN = 20000000
+# Number of candidate passwords handed to the wallet KDF at once
+PASSWORD_BATCH_SIZE = 10
 
 class MaxResultsExceeded(Exception): pass
 class WalletNotFound(object): pass
@@ -159,29 +162,38 @@ class PasswordFinder(object):
       startTime = RightNow()
       found = False
       result = None
-      for i,p in enumerate(self.passwordGenerator(segList, segOrdList)):
-         isValid = self.wallet.verifyPassphrase( SecureBinaryData(p) ) 
-            
-         if isValid:
-            # If the passphrase was wrong, it would error out, and not continue
-            print 'Passphrase found!'
-            print ''
-            print '\t', p
-            print ''
-            print 'Thanks for using this script.  If you recovered coins because of it, '
-            print 'please consider donating :) '
-            print '   1ArmoryXcfq7TnCSuZa9fQjRYwJ4bkRKfv'
-            print ''
-            found = True
-            open('FOUND_PASSWORD.txt','w').write(p)
-            result = p
+      passwordIter = self.passwordGenerator(segList, segOrdList)
+      i = -1
+      while not found:
+         # Test the candidates in batches: the wallet runs the KDF on a whole
+         # batch with its lookup table only set up once
+         batch = list(islice(passwordIter, PASSWORD_BATCH_SIZE))
+         if len(batch) == 0:
             break
-         elif i%100==0:
-               telapsed = (RightNow() - startTime)/3600.
-               print ('%d/%d passphrases tested... (%0.1f hours so far)'%(i,passwordCount,telapsed)).rjust(40)
-         print p,
-         if i % 10 == 9:
-            print
+         foundIndex = self.wallet.verifyPassphraseList( \
+                                 [SecureBinaryData(p) for p in batch])
+         for j,p in enumerate(batch):
+            i += 1
+            if j == foundIndex:
+               # If the passphrase was wrong, it would error out, and not continue
+               print 'Passphrase found!'
+               print ''
+               print '\t', p
+               print ''
+               print 'Thanks for using this script.  If you recovered coins because of it, '
+               print 'please consider donating :) '
+               print '   1ArmoryXcfq7TnCSuZa9fQjRYwJ4bkRKfv'
+               print ''
+               found = True
+               open('FOUND_PASSWORD.txt','w').write(p)
+               result = p
+               break
+            elif i%100==0:
+                  telapsed = (RightNow() - startTime)/3600.
+                  print ('%d/%d passphrases tested... (%0.1f hours so far)'%(i,passwordCount,telapsed)).rjust(40)
+            print p,
+            if i % 10 == 9:
+               print
       if not found:
          print ''
          
@@ -172,6 +172,13 @@ class ArmoryEngineTest(unittest.TestCase):
       self.callTestFunction('hash160', hex_to_binary('d418dd224e11e1d3b37b5f46b072ccf4e4e26203'), bstr)
       self.callTestFunction('binaryBits_to_difficulty', blockhashBEDifficulty, blockhashBE)
 
+      # The specialized wallet-ID encoder must agree with the generic one
+      for wltIDBin in ['\x00'*6, '\x00\x00\x01\x02\x03\x00', \
+                       '\x01\x02\x03\x04\x05\x00', '\xff'*6, \
+                       hex_to_binary('3f97e8a6c200')]:
+         self.callTestFunction('walletID_to_base58', \
+                               binary_to_base58(wltIDBin), wltIDBin)
+
    #############################################################################
    def callTestFunction(self, fnName, expectedOutput, *args, **kwargs):
       """
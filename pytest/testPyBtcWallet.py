@@ -13,9 +13,10 @@ import unittest
 from armoryengine.MultiSigUtils import readLockboxesFile
 from CppBlockUtils import SecureBinaryData
 from armoryengine.ArmoryUtils import convertKeyDataToAddress, \
-   hash256, binary_to_hex, hex_to_binary, CLI_OPTIONS, \
+   hash256, binary_to_hex, hex_to_binary, Hash160ToScrAddr, CLI_OPTIONS, \
    WalletLockError, InterruptTestError, MULTISIG_FILE_NAME
-from armoryengine.PyBtcWallet import PyBtcWallet
+from armoryengine.PyBtcWallet import PyBtcWallet, coalesceFileModifications
+import armoryengine.PyBtcWallet as PyBtcWalletModule
 from armoryengine.BDM import TheBDM
 
 
@@ -91,6 +92,89 @@ class PyBtcWalletTest(TiabTest):
       lboxWltB = PyBtcWallet().readWalletFile(lboxWltBFile)
       self.assertTrue(lboxWltB.isWltSigningAnyLockbox(lockboxList))
       
+   def testWriteFreshWalletFileWritesAllKeys(self):
+      # Every addrMap entry is written exactly once, even if
+      # linearAddr160List misses one or repeats another
+      freshPath = os.path.join(self.armoryHomeDir, 'armory_fresh_test.wallet')
+      freshBackupPath = os.path.join(self.armoryHomeDir, \
+                                     'armory_fresh_test_backup.wallet')
+      self.addCleanup(self.removeFileList, [freshPath, freshBackupPath])
+      allAddr160 = sorted(self.wlt.addrMap)
+      missing160 = self.wlt.linearAddr160List.pop()
+      self.wlt.linearAddr160List.append(self.wlt.linearAddr160List[0])
+      self.wlt.writeFreshWalletFile(freshPath)
+
+      wlt2 = PyBtcWallet().readWalletFile(freshPath)
+      self.assertEqual(sorted(wlt2.addrMap), allAddr160)
+      self.assertEqual(len(wlt2.linearAddr160List), len(allAddr160)-1)
+      self.assertEqual(wlt2.linearAddr160List[-1], missing160)
+
+   def testUnlockWithThreadPool(self):
+      # Same keys and addresses whether unlock() uses its thread pool or not,
+      # including the entries computed while locked (createPrivKeyNextUnlock)
+      passphrase = SecureBinaryData('pool passphrase')
+      wltP = PyBtcWallet().createNewWallet(withEncrypt=True, \
+                                    plainRootKey=SecureBinaryData('\xcc'*32), \
+                                    securePassphrase=passphrase, \
+                                    chaincode=SecureBinaryData('\xcd'*32), \
+                                    IV=SecureBinaryData(hex_to_binary('55'*16)), \
+                                    shortLabel=self.shortlabel,
+                                    armoryHomeDir = self.armoryHomeDir)
+      wltPath = wltP.walletPath
+      self.addCleanup(self.removeFileList, \
+                      [wltPath, wltP.getWalletPath('backup')])
+      wltP.lock()
+      for i in range(10):
+         wltP.getNextUnusedAddress()
+
+      # Both copies are read before either unlock writes its derived keys
+      wltSerial = PyBtcWallet().readWalletFile(wltPath)
+      wltPool   = PyBtcWallet().readWalletFile(wltPath)
+      self.assertTrue(any(a.createPrivKeyNextUnlock \
+                                          for a in wltPool.addrMap.values()))
+
+      origThreads = PyBtcWalletModule.WLT_UNLOCK_THREADS
+      origMinAddrs = PyBtcWalletModule.WLT_UNLOCK_POOL_MIN_ADDRS
+      origPool = PyBtcWalletModule.ThreadPool
+      self.addCleanup(setattr, PyBtcWalletModule, 'WLT_UNLOCK_THREADS', origThreads)
+      self.addCleanup(setattr, PyBtcWalletModule, 'WLT_UNLOCK_POOL_MIN_ADDRS', origMinAddrs)
+      self.addCleanup(setattr, PyBtcWalletModule, 'ThreadPool', origPool)
+
+      poolSizes = []
+      def recordingPool(nThreads):
+         poolSizes.append(nThreads)
+         return origPool(nThreads)
+      PyBtcWalletModule.ThreadPool = recordingPool
+
+      PyBtcWalletModule.WLT_UNLOCK_THREADS = 1
+      wltSerial.unlock(securePassphrase=passphrase)
+      self.assertEqual(poolSizes, [])
+
+      progress = []
+      PyBtcWalletModule.WLT_UNLOCK_THREADS = 4
+      PyBtcWalletModule.WLT_UNLOCK_POOL_MIN_ADDRS = 2
+      wltPool.unlock(securePassphrase=passphrase, \
+                     Progress=lambda i,n: progress.append((i,n)))
+      self.assertEqual(poolSizes, [4])
+
+      nAddr = len(wltPool.addrMap)
+      self.assertEqual(progress, [(i+1, nAddr) for i in range(nAddr)])
+      self.assertFalse(wltPool.isLocked)
+      self.assertEqual(sorted(wltPool.addrMap), sorted(wltSerial.addrMap))
+      for key in wltSerial.addrMap:
+         serialAddr = wltSerial.addrMap[key]
+         poolAddr   = wltPool.addrMap[key]
+         self.assertFalse(poolAddr.isLocked)
+         self.assertFalse(poolAddr.createPrivKeyNextUnlock)
+         self.assertNotEqual(poolAddr.binPrivKey32_Plain.toHexStr(), '')
+         self.assertEqual(poolAddr.binPrivKey32_Plain.toHexStr(), \
+                          serialAddr.binPrivKey32_Plain.toHexStr())
+         self.assertEqual(poolAddr.serialize(), serialAddr.serialize())
+
+      # And the keys saved by the pooled unlock read back the same
+      wlt2 = PyBtcWallet().readWalletFile(wltPath)
+      self.assertTrue(wltSerial.isEqualTo(wlt2))
+
    # Remove wallet files, need fresh dir for this test
    
    def testPyBtcWallet(self):
@@ -129,8 +213,18 @@ class PyBtcWalletTest(TiabTest):
       # Wallet size before delete:',  os.path.getsize(self.wlt.walletPath)
       # Addresses before delete:', len(self.wlt.linearAddr160List)
       toDelete160 = convertKeyDataToAddress(self.privKey2)
+      # A tx-comment lookup that found the imported key before the delete
+      self.wlt.txAddrMap['\x11'*32] = [Hash160ToScrAddr(toDelete160)]
       self.wlt.deleteImportedAddress(toDelete160)
       self.assertEqual(len(self.wlt.linearAddr160List), originalLength)
+      self.assertFalse(self.wlt.hasAddr(toDelete160))
+      self.assertFalse('\x11'*32 in self.wlt.txAddrMap)
+
+      # (2a-check) The in-memory state after the delete matches the file
+      wlt2 = PyBtcWallet().readWalletFile(self.wlt.walletPath)
+      self.assertTrue(self.wlt.isEqualTo(wlt2))
+      self.assertEqual(self.wlt.linearAddr160List, wlt2.linearAddr160List)
+      self.assertEqual(self.wlt.importList, wlt2.importList)
       
    
       # (2a) Reimporting address for remaining tests
@@ -429,6 +523,44 @@ class PyBtcWalletTest(TiabTest):
       self.assertEqual(c3, comment3)
       self.assertEqual(c2, comment2)
 
+      # Shorter (or same-size) comments are rewritten in place
+      wltSize = os.path.getsize(self.wlt.walletPath)
+      comment4 = 'Shorter comment.'
+      comment5 = 'Shorter comment!'
+      self.wlt.setComment(hash1, comment4)
+      self.wlt.setComment(hash1, comment5)
+      self.assertEqual(os.path.getsize(self.wlt.walletPath), wltSize)
+      wlt2 = PyBtcWallet().readWalletFile(self.wlt.walletPath)
+      self.assertEqual(wlt2.getComment(hash1), comment5)
+      self.assertEqual(wlt2.getComment(hash2), comment2)
+
+
+class CoalesceFileModificationsTest(unittest.TestCase):
+
+   def testAdjacentWritesMerge(self):
+      mods = [[10, 'abc'], [13, 'de'], [15, 'f']]
+      self.assertEqual(coalesceFileModifications(mods), [[10, 'abcdef']])
+
+   def testGapsStaySeparate(self):
+      mods = [[10, 'abc'], [14, 'de'], [16, 'f'], [30, 'gh']]
+      self.assertEqual(coalesceFileModifications(mods), \
+                       [[10, 'abc'], [14, 'def'], [30, 'gh']])
+
+   def testUnsortedInputComesBackSorted(self):
+      mods = [[30, 'gh'], [13, 'de'], [0, 'z'], [10, 'abc']]
+      self.assertEqual(coalesceFileModifications(mods), \
+                       [[0, 'z'], [10, 'abcde'], [30, 'gh']])
+
+   def testOverlappingWritesKeepOriginalOrder(self):
+      mods = [[20, 'xyz'], [10, 'abcdef'], [12, 'QQ']]
+      result = coalesceFileModifications(mods)
+      self.assertEqual(result, [[20, 'xyz'], [10, 'abcdef'], [12, 'QQ']])
+      self.assertTrue(result is mods)
+
+   def testShortListsUnchanged(self):
+      self.assertEqual(coalesceFileModifications([]), [])
+      self.assertEqual(coalesceFileModifications([[5, 'a']]), [[5, 'a']])
+
 # Running tests with "python <module name>" will NOT work for any Armory tests
 # You must run tests with "python -m unittest <module name>" or run all tests with "python -m unittest discover"
 # if __name__ == "__main__":
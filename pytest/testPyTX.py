@@ -9,14 +9,14 @@ import unittest
 from pytest.Tiab import TiabTest
 # Do not put any other imports before TiabTest ################
 from armoryengine.ArmoryUtils import hex_to_binary, binary_to_hex, hex_to_int, \
-   ONE_BTC
+   int_to_binary, ONE_BTC, LITTLEENDIAN
 from armoryengine.BinaryUnpacker import BinaryUnpacker
 from armoryengine.Block import PyBlock
 from armoryengine.PyBtcAddress import PyBtcAddress
 from armoryengine.Script import PyScriptProcessor
 from armoryengine.Transaction import PyTx, PyTxIn, PyOutPoint, PyTxOut, \
    PyCreateAndSignTx, getMultisigScriptInfo, BlockComponent,\
-   PyCreateAndSignTx_old
+   PyCreateAndSignTx_old, generatePreHashTxMsgToSign
 
 
 
@@ -452,6 +452,51 @@ class PyTXTest(TiabTest):
       self.assertRaises(NotImplementedError, testBlkComp.serialize)  
       self.assertRaises(NotImplementedError, testBlkComp.unserialize)  
    
+   def testPreHashTxMsgToSign(self):
+      # The sighash pre-image the way it used to be built: blank the scripts
+      # on a witness-free copy of the tx, then serialize it
+      def copyPreHashTxMsg(pytx, txInIndex, prevTxOutScript, hashcode=1):
+         txCopy = pytx.copyWithoutWitness()
+         for txin in txCopy.inputs:
+            txin.binScript = ''
+         txCopy.inputs[txInIndex].binScript = prevTxOutScript
+         return txCopy.serialize() + \
+                int_to_binary(hashcode, widthBytes=4, endOut=LITTLEENDIAN)
+
+      # Same inputs and outputs as multiTx1, with a witness for each input
+      witnessData = ''.join(['\x02\x03wit\x01' + chr(i) for i in range(4)])
+      witnessTxRaw = multiTx1raw[:4] + '\x00\x01' + multiTx1raw[4:-4] + \
+                     witnessData + multiTx1raw[-4:]
+      witnessTx = PyTx().unserialize(witnessTxRaw)
+      self.assertTrue(witnessTx.useWitness)
+      self.assertEqual(witnessTx.serialize(), witnessTxRaw)
+
+      # Non-default version, sequence numbers and lock time must carry over
+      oddTx = PyTx().unserialize(multiTx1raw)
+      oddTx.version = 2
+      oddTx.lockTime = 400000
+      for i,txin in enumerate(oddTx.inputs):
+         txin.intSeq = 0xfffffffe - i
+
+      p2pkhScript = '\x76\xa9\x14' + '\x11'*20 + '\x88\xac'
+      longScript  = '\x51'*300   # needs a 3-byte VAR_INT length
+      for pytx in [PyTx().unserialize(tx1raw), PyTx().unserialize(multiTx1raw),
+                   witnessTx, oddTx]:
+         origSerialize = pytx.serialize()
+         for txInIndex in range(len(pytx.inputs)):
+            for prevScript in [p2pkhScript, longScript, '']:
+               preHashMsg, hashCode1 = generatePreHashTxMsgToSign( \
+                                               pytx, txInIndex, prevScript)
+               self.assertEqual(preHashMsg, \
+                          copyPreHashTxMsg(pytx, txInIndex, prevScript))
+               self.assertEqual(hashCode1, '\x01')
+         # Building the pre-image never touches the tx being signed
+         self.assertEqual(pytx.serialize(), origSerialize)
+
+      # Only SIGHASH_ALL is supported
+      self.assertEqual(generatePreHashTxMsgToSign(witnessTx, 0, p2pkhScript, 2),
+                       None)
+
    # TODO:  Add some tests for the OP_CHECKMULTISIG support in TxDP
 
 # Running tests with "python <module name>" will NOT work for any Armory tests
@@ -170,7 +170,12 @@ class WalletWizard(ArmoryWizard):
             int_to_binary(self.manualEntropyPage.pageFrame.getEntropy()))
       else:
          entropy = self.main.getExtraEntropyForKeyGen()
-      self.newWallet = PyBtcWallet().createNewWallet(
+      # KDF calibration and the initial pool fill take a noticeable amount
+      # of time, run them in the progress dialog's side thread so the GUI
+      # stays responsive
+      createProgress = DlgProgress(self, self.main, HBar=1, \
+                                   Title=self.tr("Creating Wallet") )
+      self.newWallet = createProgress.exec_(PyBtcWallet().createNewWallet,
          securePassphrase=self.setPassphrasePage.pageFrame.getPassphrase(),
          kdfTargSec=self.walletCreationPage.pageFrame.getKdfSec(),
          kdfMaxMem=self.walletCreationPage.pageFrame.getKdfBytes(),
@@ -178,6 +183,7 @@ class WalletWizard(ArmoryWizard):
          longLabel=self.walletCreationPage.pageFrame.getDescription(),
          doRegisterWithBDM=False,
          extraEntropy=entropy,
+         Progress=createProgress.UpdateHBar,
       )
 
       self.newWallet.unlock(securePassphrase=